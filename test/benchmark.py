@@ -0,0 +1,268 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+"""Client benchmarks against the mock server.
+
+Run with `python -m test.benchmark [name ...]`. Each result is one JSON
+object per line, times are in seconds.
+"""
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from contextlib import asynccontextmanager
+
+from thingwala.geyserwala.aio.client import GeyserwalaClientAsync
+from thingwala.geyserwala.aio.fleet import GeyserwalaFleetAsync
+from thingwala.geyserwala.telemetry import TelemetryReader, TelemetryWriter
+
+from test.mock_geyserwala import Faults, MultiServer, Server, wait_listening
+
+BASE_PORT = 18500
+WRITABLE_KEYS = [
+    "setpoint",
+    "boost-demand",
+    "remote-demand",
+    "remote-disable",
+    "remote-setpoint",
+]
+TIMER = {'begin': [12, 34], 'end': [13, 45], 'temp': 50, 'dow': [True] * 7}
+
+
+def report(name, **fields):
+    print(json.dumps({"bench": name, **fields}), flush=True)
+
+
+def stats(samples):
+    samples = sorted(samples)
+
+    def _pct(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))], 6)
+
+    return {
+        "n": len(samples),
+        "mean": round(sum(samples) / len(samples), 6),
+        "p50": _pct(0.5),
+        "p90": _pct(0.9),
+        "p99": _pct(0.99),
+        "max": round(samples[-1], 6),
+    }
+
+
+async def timed(coro_fn, count):
+    samples = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        await coro_fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+@asynccontextmanager
+async def mock_servers(count=1, **kwargs):
+    servers = [Server(port=BASE_PORT + n, **kwargs) for n in range(count)]
+    tasks = [asyncio.create_task(server.run()) for server in servers]
+    try:
+        for server in servers:
+            await wait_listening(server._port)
+        yield servers
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@asynccontextmanager
+async def mock_client(**kwargs):
+    async with mock_servers(1, **kwargs) as (server,):
+        gw = GeyserwalaClientAsync("127.0.0.1", port=server._port)
+        gw._cache_time = 0
+        try:
+            await gw.update()
+            yield server, gw
+        finally:
+            await gw.close()
+
+
+async def update(count=500):
+    """update() latency and request rate on one client."""
+    async with mock_client() as (_, gw):
+        samples = await timed(gw.update, count)
+        report("update", requests_per_sec=round(count / sum(samples)), **stats(samples))
+
+
+async def set_value(count=500):
+    """set_value() round trip."""
+    async with mock_client() as (server, gw):
+        samples = await timed(lambda: gw.set_value("setpoint", server.value["setpoint"]), count)
+        report("set_value", **stats(samples))
+
+
+async def login(count=200):
+    """Cost of a session login."""
+    async with mock_client() as (_, gw):
+        samples = await timed(lambda: gw.login("admin", ""), count)
+        report("login", **stats(samples))
+
+
+async def timers(count=100):
+    """Timer add, list, get, update and delete round trips."""
+    async with mock_client() as (_, gw):
+        ids = []
+
+        async def _add():
+            ids.append(await gw.add_timer(TIMER))
+
+        report("timer_add", **stats(await timed(_add, count)))
+        report("timer_list", **stats(await timed(gw.list_timers, count)))
+        report("timer_get", **stats(await timed(lambda: gw.get_timer(ids[0]), count)))
+        report("timer_update", **stats(await timed(lambda: gw.update_timer(dict(TIMER, id=ids[0])), count)))
+
+        async def _delete():
+            await gw.delete_timer(ids.pop())
+
+        report("timer_delete", **stats(await timed(_delete, count)))
+
+
+async def fleet(sizes=(1, 10, 100, 1000), rounds=5, latency=0.02):
+    """Whole fleet poll time against simulated devices."""
+    for size in sizes:
+        server = MultiServer(size, base_port=BASE_PORT, faults=Faults(latency=latency))
+        task = asyncio.create_task(server.run())
+        fl = GeyserwalaFleetAsync(max_concurrency=256)
+        try:
+            for port in server.ports:
+                await wait_listening(port)
+            for n in range(size):
+                host, port = server.address(n)
+                fl.add(host, port=port)._cache_time = 0
+            await fl.update()
+
+            samples = []
+            for _ in range(rounds):
+                t0 = time.perf_counter()
+                results = await fl.update()
+                samples.append(time.perf_counter() - t0)
+            failed = sum(not r.ok for r in results.values())
+            report(
+                "fleet",
+                devices=size,
+                latency=latency,
+                failed=failed,
+                devices_per_sec=round(size * rounds / sum(samples)),
+                **stats(samples),
+            )
+        finally:
+            await fl.close()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+async def shared_client(callers=8, rounds=5, latency=0.05, max_connections=(1, 2, 4)):
+    """Several callers sharing one client: mixed status polls and writes."""
+    server = Server(port=BASE_PORT, latency=latency)
+    task = asyncio.create_task(server.run())
+    try:
+        await wait_listening(BASE_PORT)
+        for conns in max_connections:
+            gw = GeyserwalaClientAsync("127.0.0.1", port=BASE_PORT, max_connections=conns)
+            gw._cache_time = 0
+            try:
+                await gw.update()
+
+                async def _caller(i):
+                    key = WRITABLE_KEYS[i % len(WRITABLE_KEYS)]
+                    samples = []
+                    for _ in range(rounds):
+                        t0 = time.perf_counter()
+                        if i % 2:
+                            await gw.set_value(key, server.value[key])
+                        else:
+                            await gw.update()
+                        samples.append(time.perf_counter() - t0)
+                    return samples
+
+                t0 = time.perf_counter()
+                samples = sum(await asyncio.gather(*[_caller(i) for i in range(callers)]), [])
+                elapsed = time.perf_counter() - t0
+                samples.sort()
+                report(
+                    "shared_client",
+                    max_connections=conns,
+                    callers=callers,
+                    latency=latency,
+                    requests=len(samples),
+                    elapsed=round(elapsed, 4),
+                    mean=round(sum(samples) / len(samples), 4),
+                    p50=round(samples[len(samples) // 2], 4),
+                    max=round(samples[-1], 4),
+                )
+            finally:
+                await gw.close()
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def telemetry(rows=200000, block_rows=256):
+    """Append throughput and range scan speed of the telemetry log."""
+    keys = ["tank-temp", "collector-temp", "setpoint", "pump-status", "element-demand"]
+    values = {"tank-temp": 45, "collector-temp": 40, "setpoint": 50, "pump-status": False, "element-demand": True}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.gwtl")
+        t0 = time.perf_counter()
+        with TelemetryWriter(path, keys, block_rows) as writer:
+            for t in range(rows):
+                writer.append(t, values)
+        elapsed = time.perf_counter() - t0
+        report(
+            "telemetry_append",
+            rows=rows,
+            bytes=os.path.getsize(path),
+            elapsed=round(elapsed, 4),
+            rows_per_sec=round(rows / elapsed),
+        )
+
+        with TelemetryReader(path) as reader:
+            for span in (rows // 100, rows // 10, rows):
+                start = rows // 2 - span // 2
+                t0 = time.perf_counter()
+                count = sum(len(t) for t, _ in reader.scan(start, start + span, ["tank-temp"]))
+                scan = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                reader.range("tank-temp", start, start + span)
+                copy = time.perf_counter() - t0
+                report(
+                    "telemetry_scan",
+                    rows=count,
+                    scan=round(scan, 6),
+                    range=round(copy, 6),
+                    rows_per_sec=round(count / copy),
+                )
+
+
+BENCHMARKS = {
+    "update": update,
+    "set_value": set_value,
+    "login": login,
+    "timers": timers,
+    "shared_client": shared_client,
+    "fleet": fleet,
+    "telemetry": telemetry,
+}
+
+
+async def main(names):
+    with open("version", "rt", encoding="utf8") as f:
+        version = f.read().strip()
+    report("meta", version=version, python=platform.python_version(), time=time.time())
+    for name in names or BENCHMARKS:
+        await BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
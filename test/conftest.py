@@ -0,0 +1,34 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import asyncio
+
+import pytest_asyncio
+
+from test.mock_geyserwala import Server, wait_listening
+
+BASE_PORT = 18100
+
+
+@pytest_asyncio.fixture
+async def mock_devices():
+    servers = []
+    tasks = []
+
+    async def _start(count=1, **kwargs):
+        started = []
+        for _ in range(count):
+            port = BASE_PORT + len(servers)
+            server = Server(port=port, **kwargs)
+            servers.append(server)
+            tasks.append(asyncio.create_task(server.run()))
+            started.append(server)
+        for server in started:
+            await wait_listening(server._port)
+        return started
+
+    yield _start
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
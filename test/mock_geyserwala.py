@@ -1,19 +1,21 @@
 ####################################################################################
 # Copyright (c) 2023 Thingwala                                                     #
 ####################################################################################
+import argparse
 import logging
 import asyncio
+import collections
 import curses
+import random
 import time
 import threading
 import socket
 import sys
 
 from contextlib import asynccontextmanager
+from dataclasses import dataclass
 
-from aiohttp import web
-from zeroconf.asyncio import AsyncZeroconf
-from zeroconf import ServiceInfo, IPVersion
+from aiohttp import abc, web
 
 from thingwala.geyserwala.const import (
     GEYSERWALA_MODE_HOLIDAY,
@@ -29,11 +31,70 @@ PORT=8082
 HOSTNAME="geyserwala_mock"
 BIND="127.0.0.1"
 
+ROUTES = [
+    ('GET', '/', 'handle_root'),
+    ('POST', '/api/session', 'handle_post_session'),
+    ('GET', '/api/value', 'handle_get_value'),
+    ('PATCH', '/api/value', 'handle_patch_value'),
+    ('GET', '/api/value/timer', 'handle_list_timers'),
+    ('POST', '/api/value/timer', 'handle_add_timer'),
+    ('GET', '/api/value/timer/{idx}', 'handle_get_timer'),
+    ('PUT', '/api/value/timer/{idx}', 'handle_update_timer'),
+    ('DELETE', '/api/value/timer/{idx}', 'handle_delete_timer'),
+]
+
+
+@dataclass
+class Faults:
+    """Injected faults. Rates are probabilities per request, a timed out
+    request hangs for `hang` seconds before being answered."""
+    latency: float = 0
+    jitter: float = 0
+    timeout: float = 0
+    unauthorized: float = 0
+    drop: float = 0
+    malformed: float = 0
+    hang: float = 60
+    seed: int = None
+
+    def middleware(self):
+        rnd = random.Random(self.seed)
+
+        @web.middleware
+        async def _faults(request, handler):
+            delay = self.latency + (rnd.uniform(0, self.jitter) if self.jitter else 0)
+            if delay:
+                await asyncio.sleep(delay)
+            roll = rnd.random()
+            if roll < self.timeout:
+                await asyncio.sleep(self.hang)
+                return await handler(request)
+            roll -= self.timeout
+            if roll < self.unauthorized:
+                return web.json_response(
+                    data={"success": False, "message": "Unauthorized"},
+                    status=401
+                )
+            roll -= self.unauthorized
+            if roll < self.drop:
+                request.transport.abort()
+                raise ConnectionResetError("Dropped by fault injection")
+            roll -= self.drop
+            if roll < self.malformed:
+                return web.Response(text='{"success": tr', content_type='application/json')
+            return await handler(request)
+
+        return _faults
+
+
 class Server:
-    def __init__(self, hostname=None, port=None, bind=None) -> None:
+    def __init__(self, hostname=None, port=None, bind=None, latency=0, faults=None) -> None:
         self._port = int(port or PORT)
         self._bind = bind or BIND
-        self._on_update = None
+        self._latency = latency
+        self._faults = faults
+        self.requests = collections.Counter()
+        self._on_update = lambda: None
         self._run = True
         self.value = {}
 
@@ -42,6 +103,7 @@ class Server:
         self.value['hostname'] = hostname or HOSTNAME
         self.value['time'] = "12:34"
         self.value['version'] = "0.0.1"
+        self.value['features'] = {"f-collector": True}
         self.value['status'] = "Idle"
         self.value['mode'] = "SOLAR"
         self.value['tank-temp'] = 45
@@ -54,9 +116,19 @@ class Server:
         self.value['remote-disable'] = False
         self.value['remote-setpoint'] = 55
 
+        self.timers = {}
+        self._timer_id = 0
+
     def on_update(self, on_update):
         self._on_update = on_update or (lambda:None)
 
+    @web.middleware
+    async def request_middleware(self, request, handler):
+        self.requests[(request.method, request.path)] += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        return await handler(request)
+
     async def handle_root(self, request):
         return web.json_response(
             data={"success": False, "message": "Not found"},
@@ -109,7 +181,57 @@ class Server:
         self._on_update()
         return web.json_response(data=blob)
 
+    def _not_found(self):
+        return web.json_response(
+            data={"success": False, "message": "Not found"},
+            status=404
+        )
+
+    async def handle_list_timers(self, request):
+        if not self._authed(request):
+            return self._unauthorised()
+        return web.json_response(data=list(self.timers.values()))
+
+    async def handle_get_timer(self, request):
+        if not self._authed(request):
+            return self._unauthorised()
+        try:
+            return web.json_response(data=self.timers[int(request.match_info['idx'])])
+        except KeyError:
+            return self._not_found()
+
+    async def handle_add_timer(self, request):
+        if not self._authed(request):
+            return self._unauthorised()
+        timer = await request.json()
+        self._timer_id += 1
+        timer['id'] = self._timer_id
+        self.timers[timer['id']] = timer
+        return web.json_response(data={"success": True, "id": timer['id']})
+
+    async def handle_update_timer(self, request):
+        if not self._authed(request):
+            return self._unauthorised()
+        idx = int(request.match_info['idx'])
+        if idx not in self.timers:
+            return self._not_found()
+        timer = await request.json()
+        timer['id'] = idx
+        self.timers[idx] = timer
+        return web.json_response(data=timer)
+
+    async def handle_delete_timer(self, request):
+        if not self._authed(request):
+            return self._unauthorised()
+        idx = int(request.match_info['idx'])
+        if self.timers.pop(idx, None) is None:
+            return self._not_found()
+        return web.json_response(data={"success": True, "id": idx})
+
     async def register_mdns(self):
+        from zeroconf.asyncio import AsyncZeroconf
+        from zeroconf import ServiceInfo, IPVersion
+
         logger.info('Registering mDNS %s ', self.value['hostname'])
         aio_zc = AsyncZeroconf(ip_version=IPVersion.V4Only)
 
@@ -126,11 +248,12 @@ class Server:
         await aio_zc.async_register_service(info)
 
     async def run(self):
-        app = web.Application()
-        app.router.add_get('/', self.handle_root)
-        app.router.add_post('/api/session', self.handle_post_session)
-        app.router.add_get('/api/value', self.handle_get_value)
-        app.router.add_patch('/api/value', self.handle_patch_value)
+        middlewares = [self.request_middleware]
+        if self._faults:
+            middlewares.append(self._faults.middleware())
+        app = web.Application(middlewares=middlewares)
+        for method, path, name in ROUTES:
+            app.router.add_route(method, path, getattr(self, name))
 
         runner = web.AppRunner(app)
         try:
@@ -149,6 +272,115 @@ class Server:
             await runner.cleanup()
 
 
+class MultiServer:
+    """Many virtual devices in one process, headless. With port routing each
+    device listens on its own port from base_port. With host routing all share
+    one port and are picked by the Host header, mock-<n>, see MockResolver."""
+
+    def __init__(self, count, base_port=None, bind=None, routing="port", faults=None) -> None:
+        if routing not in ("port", "host"):
+            raise ValueError(f"Unknown routing: {routing}")
+        self._base_port = int(base_port or PORT)
+        self._bind = bind or BIND
+        self._routing = routing
+        self._faults = faults
+        self._run = True
+        self.devices = []
+        self._by_port = {}
+        self._by_host = {}
+        for n in range(count):
+            port = self._base_port + n if routing == "port" else self._base_port
+            device = Server(hostname=f"mock-{n}", port=port, bind=self._bind)
+            device.value['id'] = f"0123456789{n:06d}"
+            device.value['name'] = f"Mock-{n}"
+            self.devices.append(device)
+            self._by_port[port] = device
+            self._by_host[device.value['hostname']] = device
+
+    @property
+    def ports(self):
+        return sorted({d._port for d in self.devices})
+
+    def address(self, n):
+        device = self.devices[n]
+        if self._routing == "port":
+            return self._bind, device._port
+        return device.value['hostname'], device._port
+
+    def _route(self, request):
+        if self._routing == "port":
+            return self._by_port.get(request.transport.get_extra_info('sockname')[1])
+        return self._by_host.get(request.host.rsplit(':', 1)[0])
+
+    def _dispatch(self, name):
+        async def _handler(request):
+            device = self._route(request)
+            if device is None:
+                return web.json_response(
+                    data={"success": False, "message": "No such device"},
+                    status=404
+                )
+            device.requests[(request.method, request.path)] += 1
+            return await getattr(device, name)(request)
+        return _handler
+
+    async def run(self):
+        middlewares = [self._faults.middleware()] if self._faults else []
+        app = web.Application(middlewares=middlewares)
+        for method, path, name in ROUTES:
+            app.router.add_route(method, path, self._dispatch(name))
+
+        runner = web.AppRunner(app)
+        try:
+            await runner.setup()
+            for port in self.ports:
+                await web.TCPSite(runner, self._bind, port).start()
+            logger.info("Serving %d devices on %s:%s", len(self.devices), self._bind, self.ports)
+
+            while self._run:
+                await asyncio.sleep(2)
+        except Exception:
+            logger.exception("MultiServer::run")
+        finally:
+            await runner.cleanup()
+
+
+class MockResolver(abc.AbstractResolver):
+    """Resolves every mock-<n> host name to the bind address, for host routing."""
+
+    def __init__(self, bind=None) -> None:
+        self._bind = bind or BIND
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        if not host.startswith("mock-"):
+            raise OSError(f"Unknown mock host: {host}")
+        return [{
+            "hostname": host,
+            "host": self._bind,
+            "port": port,
+            "family": socket.AF_INET,
+            "proto": 0,
+            "flags": socket.AI_NUMERICHOST,
+        }]
+
+    async def close(self):
+        pass
+
+
+async def wait_listening(port, host=BIND, timeout=5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if loop.time() > deadline:
+                raise
+            await asyncio.sleep(0.01)
+
+
 class Display():
     def __init__(self, stdscr, gw) -> None:
         self._stdscr = stdscr
@@ -293,6 +525,12 @@ def server(port=None):
     loop.run_until_complete(_coro())
 
 
+def headless(devices=1, port=None, routing="port", faults=None):
+    setup_cli_logger()
+    server = MultiServer(devices, base_port=port, routing=routing, faults=faults)
+    asyncio.run(server.run())
+
+
 def setup_file_logger(filename='gw.log'):
     logging.basicConfig(filename=filename,
                        filemode='a',
@@ -312,9 +550,33 @@ def setup_cli_logger():
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Mock Geyserwala")
+    parser.add_argument("port", nargs="?", type=int)
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--routing", choices=["port", "host"], default="port")
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--timeout", type=float, default=0, help="rate")
+    parser.add_argument("--unauthorized", type=float, default=0, help="rate")
+    parser.add_argument("--drop", type=float, default=0, help="rate")
+    parser.add_argument("--malformed", type=float, default=0, help="rate")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
     try:
-        display(*sys.argv[1:])
-        # server(*sys.argv[1:])
+        if args.headless:
+            faults = Faults(
+                latency=args.latency,
+                jitter=args.jitter,
+                timeout=args.timeout,
+                unauthorized=args.unauthorized,
+                drop=args.drop,
+                malformed=args.malformed,
+                seed=args.seed,
+            )
+            headless(args.devices, args.port, args.routing, faults)
+        else:
+            display(args.port)
     except KeyboardInterrupt:
         pass
 
@@ -0,0 +1,424 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import asyncio
+import dataclasses
+import os
+
+import aiohttp
+import pytest
+import pytest_asyncio
+
+from thingwala.geyserwala.aio.client import GeyserwalaClientAsync
+from thingwala.geyserwala.aio.tracing import GeyserwalaTracer
+from thingwala.geyserwala.errors import RequestError, Unauthorized
+from thingwala.geyserwala.store import GeyserwalaStateStore
+
+
+@pytest_asyncio.fixture
+async def device(mock_devices):
+    server, = await mock_devices(1, latency=0.02)
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port)
+    try:
+        yield server, gw
+    finally:
+        await gw.close()
+
+
+@pytest.mark.asyncio
+async def test_update_coalesced(device):
+    server, gw = device
+    gw.subscribe("setpoint")
+
+    async def _refresh(key):
+        return await gw._update_keys(["id", key])
+
+    results = await asyncio.gather(
+        gw.update(), _refresh("pump-status"), _refresh("collector-temp")
+    )
+    assert all(results)
+    assert server.requests[("GET", "/api/value")] == 1
+    assert gw.get_value("setpoint") == server.value["setpoint"]
+    assert gw.get_value("pump-status") == server.value["pump-status"]
+    assert gw.get_value("collector-temp") == server.value["collector-temp"]
+
+
+@pytest.mark.asyncio
+async def test_update_per_key_ttl(device, monkeypatch):
+    _, gw = device
+    now = [1000.0]
+    monkeypatch.setattr(gw, "_now", lambda: now[0])
+    queries = []
+    json_req = gw._json_req
+
+    async def _spy(method, path, params=None, json=None, **kwargs):
+        if path == "api/value" and method == "GET":
+            queries.append(params["f"].split(","))
+        return await json_req(method, path, params=params, json=json, **kwargs)
+
+    monkeypatch.setattr(gw, "_json_req", _spy)
+    gw.subscribe("setpoint", ttl=60)
+    gw.set_ttl("tank-temp", 5)
+
+    await gw.update()
+    assert "setpoint" in queries[-1]
+
+    now[0] += 1
+    await gw.update()
+    assert "tank-temp" not in queries[-1]
+    assert "setpoint" not in queries[-1]
+    assert "status" in queries[-1]
+
+    now[0] += 5
+    await gw.update()
+    assert "tank-temp" in queries[-1]
+    assert "setpoint" not in queries[-1]
+
+    count = len(queries)
+    await gw.update()
+    assert len(queries) == count
+
+
+@pytest.mark.asyncio
+async def test_update_static_keys(device, monkeypatch):
+    server, gw = device
+    queries = []
+    json_req = gw._json_req
+
+    async def _spy(method, path, params=None, json=None, **kwargs):
+        if path == "api/value" and method == "GET":
+            queries.append(params["f"].split(","))
+        return await json_req(method, path, params=params, json=json, **kwargs)
+
+    monkeypatch.setattr(gw, "_json_req", _spy)
+    gw._cache_time = 0
+    gw.subscribe("collector-temp")
+
+    await gw.update()
+    assert "features" in queries[-1]
+    assert "collector-temp" in queries[-1]
+    assert gw._capabilities[server.value["id"]]["version"] == server.value["version"]
+
+    await gw.update()
+    assert "features" not in queries[-1]
+    assert "tank-temp" in queries[-1]
+
+    await gw.login("admin", "")
+    await gw.update()
+    assert "features" in queries[-1]
+
+    server.value["features"] = {"f-pv-panel": True}
+    await gw.login("admin", "")
+    await gw.update()
+    await gw.update()
+    assert "collector-temp" not in queries[-1]
+
+
+@pytest.mark.asyncio
+async def test_change_listeners(device):
+    server, gw = device
+    gw._cache_time = 0
+    changes = []
+    setpoints = []
+    gw.add_listener(lambda *c: changes.append(c))
+    remove = gw.add_listener(lambda *c: setpoints.append(c), "setpoint")
+    gw.subscribe("setpoint")
+
+    await gw.update()
+    assert ("setpoint", None, server.value["setpoint"]) in changes
+    assert len(setpoints) == 1
+
+    changes.clear()
+    await gw.update()
+    assert not changes
+
+    server.value["tank-temp"] += 1
+    await gw.update()
+    assert changes == [("tank-temp", server.value["tank-temp"] - 1, server.value["tank-temp"])]
+
+    remove()
+    await gw.set_value("setpoint", server.value["setpoint"] + 1)
+    assert changes[-1][0] == "setpoint"
+    assert len(setpoints) == 1
+
+
+@pytest.mark.asyncio
+async def test_watch_skips_stale_snapshots(device):
+    server, gw = device
+    gw._cache_time = 0
+    snapshots = []
+    async for snapshot in gw.watch(["tank-temp"], interval=0):
+        with pytest.raises(TypeError):
+            snapshot["tank-temp"] = 0
+        snapshots.append(snapshot)
+        server.value["tank-temp"] += 1
+        await asyncio.sleep(0.2)
+        if len(snapshots) == 3:
+            break
+    assert [s["tank-temp"] for s in snapshots] == [45, 46, 47]
+    assert server.requests[("GET", "/api/value")] > 2 * len(snapshots)
+
+
+@pytest.mark.asyncio
+async def test_set_values(device):
+    server, gw = device
+    ret = await gw.set_values({"setpoint": 60, "boost-demand": True, "unknown": 1})
+    assert ret == {"setpoint": True, "boost-demand": True, "unknown": False}
+    assert server.requests[("PATCH", "/api/value")] == 1
+    assert server.value["setpoint"] == 60
+    assert gw.get_value("boost-demand") is True
+
+
+@pytest.mark.asyncio
+async def test_state_snapshot(device):
+    server, gw = device
+    gw._cache_time = 0
+    server.value["features"] = {"f-collector": True, "f-pv-panel": False}
+    server.value["schedule"] = [{"on": "06:00", "days": [1, 2]}]
+    gw.subscribe("remote-setpoint")
+    gw.subscribe("schedule")
+    assert gw.state.id is None and gw.id == "?"
+
+    await gw.update()
+    state = gw.state
+    assert state.id == server.value["id"]
+    assert state.tank_temp == 45
+    assert state.features == (("f-collector", True), ("f-pv-panel", False))
+    assert gw.has_feature("f-collector") and not gw.has_feature("f-pv-panel")
+    # Values come back in the device's format
+    assert gw.get_value("features") == server.value["features"]
+    assert gw.get_value("schedule") == server.value["schedule"]
+    assert gw.get_value("schedule") is not gw.get_value("schedule")
+    assert gw._snapshot(["schedule"])["schedule"] == server.value["schedule"]
+    assert state.to_dict()["schedule"] == server.value["schedule"]
+    assert state.get("remote-setpoint") == 55
+    assert state.get("setpoint") is None
+    hash(state)
+
+    await gw.update()
+    assert gw.state is state
+
+    assert await gw.set_mode("SETPOINT")
+    assert gw.state.mode == "SETPOINT"
+    assert state.mode == "SOLAR"
+    assert gw.state._replace(mode="SOLAR") == state
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate(device):
+    server, gw = device
+    gets = ("GET", "/api/value")
+
+    # Nothing cached yet, waits for the first fetch
+    state, age = await gw.read()
+    assert state.tank_temp == 45 and age < 1
+    assert server.requests[gets] == 1
+
+    # Stale but within max_stale: cached values now, one shared refresh
+    for key in gw._dynamic_keys:
+        gw._fetched[key] -= 10
+    server.value["tank-temp"] = 50
+    results = await asyncio.gather(gw.read(), gw.read(), asyncio.sleep(0))
+    assert [(s.tank_temp, a >= 10) for s, a in results[:2]] == [(45, True)] * 2
+    value, age = gw.peek("tank-temp")
+    assert value == 45 and age >= 10
+    await gw._revalidation
+    assert server.requests[gets] == 2
+    assert gw.peek("tank-temp")[0] == 50
+
+    # Past max_stale, waits for fresh data
+    for key in gw._dynamic_keys:
+        gw._fetched[key] -= 120
+    server.value["tank-temp"] = 55
+    state, age = await gw.read(max_stale=60)
+    assert state.tank_temp == 55 and age < 1
+    assert server.requests[gets] == 3
+
+    # A long freshness window does not stretch the hard limit
+    gw.subscribe("setpoint", ttl=300)
+    await gw.read()
+    gw._fetched["setpoint"] -= 120
+    server.value["setpoint"] = 65
+    state, age = await gw.read(max_stale=60)
+    assert state.setpoint == 65 and age < 1
+
+
+@pytest.mark.asyncio
+async def test_set_value_debounced(mock_devices):
+    server, = await mock_devices(1)
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port, write_debounce=0.05)
+    try:
+        ret = await asyncio.gather(
+            gw.set_value("setpoint", 51),
+            gw.set_value("setpoint", 52),
+            gw.set_value("boost-demand", True),
+        )
+        assert ret == [True, True, True]
+        assert server.requests[("PATCH", "/api/value")] == 1
+        assert server.value["setpoint"] == 52
+
+        ret = await asyncio.gather(
+            gw.set_value("setpoint", 51),
+            gw.set_values({"setpoint": 60, "mode": "TIMER"}),
+            gw.set_mode("SETPOINT"),
+        )
+        assert ret == [True, {"setpoint": True, "mode": True}, True]
+        assert server.requests[("PATCH", "/api/value")] == 2
+        assert server.value["setpoint"] == 60
+        assert server.value["mode"] == "SETPOINT"
+    finally:
+        await gw.close()
+
+
+@pytest.mark.asyncio
+async def test_state_store_warm_start(mock_devices, tmp_path):
+    server, = await mock_devices(1)
+    store = GeyserwalaStateStore(tmp_path / "state.json")
+
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port, state_store=store)
+    gw.subscribe("setpoint")
+    await gw.update()
+    await gw.close()
+    assert server.requests[("POST", "/api/session")] == 1
+    assert store.dirty
+    await store.close()
+    assert not store.dirty
+
+    store = GeyserwalaStateStore(tmp_path / "state.json")
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port, state_store=store)
+    try:
+        assert gw.name == server.value["name"]
+        assert gw.get_value("setpoint") == server.value["setpoint"]
+        assert gw.authorized
+        await gw.update()
+        assert server.requests[("POST", "/api/session")] == 1
+    finally:
+        await gw.close()
+
+
+@pytest.mark.asyncio
+async def test_state_store_batches_writes(tmp_path, monkeypatch):
+    store = GeyserwalaStateStore(tmp_path / "state.json", flush_delay=0.05)
+    writes = []
+    write = store._write
+    monkeypatch.setattr(store, "_write", lambda blob: writes.append(blob) or write(blob))
+
+    for n in range(100):
+        store.put(f"device-{n}", token=str(n))
+    assert not writes
+    await asyncio.sleep(0.2)
+    assert len(writes) == 1 and not store.dirty
+    assert GeyserwalaStateStore(tmp_path / "state.json").get("device-99") is not None
+
+    store.remove("device-0")
+    await store.close()
+    assert len(writes) == 2
+    assert os.stat(tmp_path / "state.json").st_mode & 0o777 == 0o600
+    assert GeyserwalaStateStore(tmp_path / "state.json").get("device-0") is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_relogin_shared(device):
+    server, gw = device
+    await gw.update()
+    gw._token = "expired"
+    gw._cache_time = 0
+    with pytest.raises(Unauthorized):
+        await gw.update()
+    await asyncio.gather(*[gw.set_value("setpoint", 50 + i) for i in range(4)])
+    assert server.requests[("POST", "/api/session")] == 2
+
+
+@pytest.mark.asyncio
+async def test_metrics(mock_devices):
+    server, = await mock_devices(1)
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port, metrics=True)
+    try:
+        await gw.update()
+        await gw.update()
+        with pytest.raises(RequestError):
+            await gw.get_timer(7)
+        gw._token = "expired"
+        gw._cache_time = 0
+        with pytest.raises(Unauthorized):
+            await gw.update()
+        stats = gw.stats()
+        assert stats["requests"] == {
+            "POST api/session": 1,
+            "GET api/value": 2,
+            "GET api/value/timer/{idx}": 1,
+        }
+        assert stats["errors"] == {
+            "GET api/value/timer/{idx} RequestError": 1,
+            "GET api/value Unauthorized": 1,
+        }
+        assert stats["status"] == {200: 2, 404: 1, 401: 1}
+        assert stats["cache"] == {"miss": 2, "hit": 1}
+        assert stats["latency"]["GET api/value"]["count"] == 2
+        assert stats["bytes_received"] > 0
+    finally:
+        await gw.close()
+
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port)
+    assert gw.stats() is None
+    await gw.close()
+
+
+@pytest.mark.asyncio
+async def test_tracing(mock_devices):
+    server, = await mock_devices(1, latency=0.02)
+    tracer = GeyserwalaTracer()
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port, tracer=tracer)
+    try:
+        await gw.update()
+        await gw.set_value("setpoint", 55)
+    finally:
+        await gw.close()
+
+    login, get, patch = list(tracer.sink)
+    assert (login.method, login.path, login.device) == ("POST", "api/session", f"127.0.0.1:{server._port}")
+    assert login.connect is not None and not login.reused
+    assert patch.device == server.value["id"]
+    assert get.reused and get.connect is None
+    assert get.wait >= 0.02
+    assert get.body is not None and get.status == 200
+    assert patch.total >= patch.wait
+    assert login.queue is not None and login.queue < 0.01
+
+
+@pytest.mark.asyncio
+async def test_tracing_excludes_queue(mock_devices):
+    server, = await mock_devices(1, latency=0.05)
+    tracer = GeyserwalaTracer()
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port, tracer=tracer, max_connections=1)
+    try:
+        await gw.update()
+        tracer.sink.clear()
+        await asyncio.gather(gw.set_value("setpoint", 51), gw.set_value("mode", "TIMER"))
+    finally:
+        await gw.close()
+
+    first, second = list(tracer.sink)
+    # The second write waits out the first in the client, not on the device
+    assert second.queue >= 0.04
+    assert second.total < first.total + 0.04
+
+
+@pytest.mark.asyncio
+async def test_tracing_shared_session(mock_devices):
+    server, = await mock_devices(1)
+    spans = []
+    tracer = GeyserwalaTracer(spans.append)
+    session = aiohttp.ClientSession()
+    with pytest.raises(ValueError):
+        GeyserwalaClientAsync("127.0.0.1", port=server._port, session=session, tracer=tracer)
+    await session.close()
+
+    session = aiohttp.ClientSession(trace_configs=[tracer.trace_config])
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port, session=session, tracer=tracer)
+    try:
+        await gw.update()
+    finally:
+        await session.close()
+    assert [s.path for s in spans] == ["api/session", "api/value"]
+    assert "t0" not in repr(spans[0]) and "_sent" not in dataclasses.asdict(spans[0])
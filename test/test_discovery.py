@@ -1,12 +1,176 @@
 ####################################################################################
 # Copyright (c) 2023 Thingwala                                                     #
 ####################################################################################
-from thingwala.geyserwala.aio.discovery import GeyserwalaDiscoveryAsync
+import asyncio
+import time
+
+from types import SimpleNamespace
+
+from thingwala.geyserwala.aio import discovery
+from thingwala.geyserwala.aio.discovery import (
+    Device,
+    GeyserwalaDiscoveryAsync,
+    GeyserwalaDiscoveryCache,
+)
 
 import pytest
 
+from test.mock_geyserwala import Faults
+
+SERVICE = GeyserwalaDiscoveryAsync.services
+
 
 @pytest.mark.asyncio
 async def test_discovery():
     dsc = GeyserwalaDiscoveryAsync()
     res = await dsc.mdns_discover()
+
+
+class _Browser:
+    """Stands in for AsyncServiceBrowser, announcing the fake services."""
+
+    def __init__(self, zeroconf, service_type, handlers):
+        for name in zeroconf.delays:
+            for handler in handlers:
+                handler(zeroconf, service_type, name, SimpleNamespace(name="Added"))
+
+    async def async_cancel(self):
+        pass
+
+
+class _Zeroconf:
+    """Stands in for AsyncZeroconf. Each service resolves after its delay,
+    None never resolves."""
+
+    delays = {}
+
+    def __init__(self, *args, **kwargs):
+        self.zeroconf = self
+        self.cancelled = []
+        _Zeroconf.last = self
+
+    async def async_get_service_info(self, _service_type, name):
+        delay = self.delays[name]
+        try:
+            await asyncio.sleep(3600 if delay is None else delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(name)
+            raise
+        device_id = name.split(".")[0]
+        return SimpleNamespace(
+            properties={b"id": device_id.encode()},
+            port=80,
+            server=f"{device_id}.local.",
+            parsed_addresses=lambda: ["10.0.0.1"],
+        )
+
+    async def async_close(self):
+        pass
+
+
+@pytest.fixture
+def fake_mdns(monkeypatch):
+    monkeypatch.setattr(discovery, "AsyncZeroconf", _Zeroconf)
+    monkeypatch.setattr(discovery, "AsyncServiceBrowser", _Browser)
+
+    def _services(**delays):
+        _Zeroconf.delays = {f"{k}.{SERVICE}": v for k, v in delays.items()}
+
+    return _services
+
+
+async def _stream(**kwargs):
+    t0 = time.perf_counter()
+    ids = [d.id async for d in GeyserwalaDiscoveryAsync().mdns_stream(**kwargs)]
+    return ids, time.perf_counter() - t0
+
+
+@pytest.mark.asyncio
+async def test_discovery_stream_resolves_concurrently(fake_mdns):
+    fake_mdns(a=0.1, b=0.05, c=0.1, d=0.1)
+    ids, elapsed = await _stream(timeout=0.3)
+    # Yielded in resolve order, not announce order
+    assert ids[0] == "b" and sorted(ids) == ["a", "b", "c", "d"]
+    assert elapsed < 0.35
+
+
+@pytest.mark.asyncio
+async def test_discovery_stream_expected(fake_mdns):
+    fake_mdns(a=0.02, b=0.01, c=None)
+    ids, elapsed = await _stream(timeout=10, expected=2)
+    assert ids == ["b", "a"] and elapsed < 1
+    assert _Zeroconf.last.cancelled == [f"c.{SERVICE}"]
+
+
+@pytest.mark.asyncio
+async def test_discovery_stream_ids(fake_mdns):
+    fake_mdns(a=0.01, b=None, c=0.02, d=0.03)
+    ids, elapsed = await _stream(timeout=10, ids=["a", "c"])
+    assert ids == ["a", "c"] and elapsed < 1
+    assert sorted(_Zeroconf.last.cancelled) == [f"b.{SERVICE}", f"d.{SERVICE}"]
+
+
+@pytest.mark.asyncio
+async def test_discovery_cache_skips_mdns(mock_devices, tmp_path, monkeypatch):
+    server, = await mock_devices(1)
+    cache = GeyserwalaDiscoveryCache(tmp_path / "devices.json")
+    cache.put(Device("127.0.0.1", server._port, "mock.local.", {"id": server.value["id"]}))
+    cache.flush()
+
+    dsc = GeyserwalaDiscoveryAsync()
+
+    def _no_mdns(*args, **kwargs):
+        raise AssertionError("mDNS scan not expected")
+
+    monkeypatch.setattr(dsc, "mdns_stream", _no_mdns)
+    cache = GeyserwalaDiscoveryCache(tmp_path / "devices.json")
+    res = await dsc.cached_discover(cache)
+    assert [d.id for d in res] == [server.value["id"]]
+
+
+@pytest.mark.asyncio
+async def test_discovery_cache_changed_and_dead(mock_devices, tmp_path, monkeypatch):
+    server, = await mock_devices(1)
+    cache = GeyserwalaDiscoveryCache(tmp_path / "devices.json")
+    # Another unit now answers at "moved"'s address, nothing at "dead"'s
+    cache.put(Device("127.0.0.1", server._port, "moved.local.", {"id": "moved"}))
+    cache.put(Device("127.0.0.1", 18199, "dead.local.", {"id": "dead"}))
+    cache.put(Device("127.0.0.1", 18198, "old.local.", {"id": "old"}), time.time() - 30 * 86400)
+
+    dsc = GeyserwalaDiscoveryAsync()
+    scans = []
+
+    async def _mdns_stream(timeout=10, expected=None, ids=None):
+        scans.append(sorted(ids or []))
+        for _ in ():
+            yield
+
+    monkeypatch.setattr(dsc, "mdns_stream", _mdns_stream)
+
+    assert await dsc.cached_discover(cache, max_misses=2) == []
+    assert scans == [["dead", "moved"]]
+    assert cache.last_seen("old") is None
+    assert cache.misses("dead") == 1 and cache.misses("moved") == 1
+
+    await dsc.cached_discover(cache, max_misses=2)
+    await dsc.cached_discover(cache, max_misses=2)
+    # Missed twice in a row, dropped before the third run, which is a full scan
+    assert cache.devices() == []
+    assert scans[-1] == []
+
+
+@pytest.mark.asyncio
+async def test_discovery_cache_unauthorized(mock_devices, tmp_path, monkeypatch, caplog):
+    server, = await mock_devices(1, faults=Faults(unauthorized=1))
+    cache = GeyserwalaDiscoveryCache(tmp_path / "devices.json")
+    cache.put(Device("127.0.0.1", server._port, "mock.local.", {"id": server.value["id"]}))
+
+    dsc = GeyserwalaDiscoveryAsync()
+
+    async def _mdns_stream(timeout=10, expected=None, ids=None):
+        for _ in ():
+            yield
+
+    monkeypatch.setattr(dsc, "mdns_stream", _mdns_stream)
+    assert await dsc.cached_discover(cache, username="admin", password="wrong") == []
+    assert "check the credentials" in caplog.text
@@ -0,0 +1,122 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+from thingwala.geyserwala.aio.client import GeyserwalaClientAsync
+from thingwala.geyserwala.aio.fleet import GeyserwalaFleetAsync
+from thingwala.geyserwala.aio.health import HEALTH_CLOSED, HEALTH_OPEN, DeviceHealth
+from thingwala.geyserwala.errors import CircuitOpen, RequestError, Unauthorized
+
+from test.conftest import BASE_PORT
+from test.mock_geyserwala import Faults, MockResolver, MultiServer, wait_listening
+
+
+@pytest.mark.parametrize("faults, error", [
+    (Faults(unauthorized=1), Unauthorized),
+    (Faults(malformed=1), RequestError),
+    (Faults(drop=1), RequestError),
+    (Faults(timeout=1, hang=1), RequestError),
+])
+@pytest.mark.asyncio
+async def test_fault_errors(mock_devices, faults, error):
+    server, = await mock_devices(1, faults=faults)
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port)
+    gw._rest_timeout = 0.2
+    try:
+        with pytest.raises(error):
+            await gw.update()
+    finally:
+        await gw.close()
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker(mock_devices):
+    # Nothing listens on the port until the server is started below
+    health = DeviceHealth(threshold=3, backoff=0.2)
+    gw = GeyserwalaClientAsync("127.0.0.1", port=BASE_PORT, retries=1, health=health)
+    try:
+        # The login POST is not retried, one failure each
+        for _ in range(3):
+            with pytest.raises(RequestError):
+                await gw.update()
+        assert health.state == HEALTH_OPEN
+        t0 = time.perf_counter()
+        with pytest.raises(CircuitOpen):
+            await gw.update()
+        assert time.perf_counter() - t0 < 0.01
+
+        server, = await mock_devices(1)
+        await asyncio.sleep(health.retry_after)
+        assert await gw.update()
+        assert health.state == HEALTH_CLOSED
+        assert server.requests[("GET", "/api/value")] == 1
+    finally:
+        await gw.close()
+
+
+def test_retry_budget():
+    health = DeviceHealth(retry_ratio=0.5, min_retries=1)
+    assert health.can_retry()
+    assert not health.can_retry()
+    health.allow()
+    health.allow()
+    assert health.can_retry()
+
+
+def test_concurrent_failures():
+    health = DeviceHealth(threshold=3, backoff=1, jitter=0)
+    # Five requests in flight when the device goes away
+    tickets = [health.allow() for _ in range(5)]
+    for ticket in tickets:
+        health.record_failure(ticket=ticket)
+    assert health.state == HEALTH_OPEN
+    assert health.failures == 5
+    assert 0.9 < health.retry_after <= 1
+
+    # Only the probe's failure extends the backoff, a straggler does not
+    health._retry_at = 0
+    probe = health.allow()
+    assert probe and not health.allow()
+    health.record_failure(ticket=tickets[0])
+    assert not health.allow()
+    health.record_failure(ticket=probe)
+    assert 1.9 < health.retry_after <= 2
+
+    # A cancelled probe frees the slot for the next one
+    health._retry_at = 0
+    probe = health.allow()
+    health.release(tickets[0])
+    assert not health.allow()
+    health.release(probe)
+    assert health.allow()
+
+
+@pytest.mark.parametrize("routing", ["port", "host"])
+@pytest.mark.asyncio
+async def test_multi_server(routing):
+    server = MultiServer(20, base_port=18300, routing=routing, faults=Faults(latency=0.01))
+    task = asyncio.create_task(server.run())
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(resolver=MockResolver()))
+    fleet = GeyserwalaFleetAsync(session=session)
+    try:
+        for port in server.ports:
+            await wait_listening(port)
+        for n in range(len(server.devices)):
+            host, port = server.address(n)
+            fleet.add(host, port=port)
+        results = await fleet.update()
+        assert all(r.ok for r in results.values())
+        assert sorted(r.client.id for r in results.values()) == sorted(
+            d.value['id'] for d in server.devices
+        )
+        assert all(d.requests[("GET", "/api/value")] == 1 for d in server.devices)
+    finally:
+        await fleet.close()
+        await session.close()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,79 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import asyncio
+
+import pytest
+
+from thingwala.geyserwala.aio.fleet import GeyserwalaFleetAsync
+from thingwala.geyserwala.aio.pool import GeyserwalaConnectionPool
+from thingwala.geyserwala.poll import AdaptivePollInterval
+
+
+@pytest.mark.asyncio
+async def test_fleet_update(mock_devices):
+    servers = await mock_devices(5)
+    fleet = GeyserwalaFleetAsync(max_concurrency=2)
+    try:
+        for server in servers:
+            fleet.add("127.0.0.1", port=server._port)
+        fleet.add("127.0.0.1", port=1, key="dead")
+
+        results = await fleet.update()
+        assert len(results) == 6
+        assert not results["dead"].ok
+        assert results["dead"].error is not None
+        for server in servers:
+            result = results[f"127.0.0.1:{server._port}"]
+            assert result.ok
+            assert result.client.id == server.value['id']
+    finally:
+        await fleet.close()
+
+
+@pytest.mark.asyncio
+async def test_fleet_run_adaptive(mock_devices):
+    servers = await mock_devices(3)
+    fleet = GeyserwalaFleetAsync()
+    try:
+        for server in servers:
+            fleet.add("127.0.0.1", port=server._port)._cache_time = 0
+        task = asyncio.ensure_future(
+            fleet.run(lambda client: AdaptivePollInterval(0.01, 0.05).attach(client))
+        )
+        await asyncio.sleep(0.3)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        for server in servers:
+            assert server.requests[("GET", "/api/value")] > 3
+    finally:
+        await fleet.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_shared_between_clients(mock_devices):
+    servers = await mock_devices(3)
+    async with GeyserwalaConnectionPool(limit_per_host=1) as pool:
+        clients = [pool.client("127.0.0.1", port=s._port) for s in servers]
+        for client in clients:
+            await client.update()
+        await clients[0].close()
+        assert not pool.session.closed
+        await asyncio.gather(*[c.update() for c in clients[1:]])
+        assert [c.id for c in clients] == [s.value["id"] for s in servers]
+        assert len({c._token for c in clients}) == 3
+
+
+def test_fleet_outside_loop():
+    fleet = GeyserwalaFleetAsync()
+    assert len(fleet) == 0
+
+    async def _use():
+        pool = GeyserwalaConnectionPool()
+        shared = GeyserwalaFleetAsync(pool=pool)
+        first = shared.session
+        await pool.close()
+        assert shared.session is not first and not shared.session.closed
+        await pool.close()
+
+    asyncio.run(_use())
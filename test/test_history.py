@@ -0,0 +1,53 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import pytest
+
+from thingwala.geyserwala.aio.client import GeyserwalaClientAsync
+from thingwala.geyserwala.history import GeyserwalaHistory, SeriesHistory
+
+
+def test_series_ring_wraps():
+    series = SeriesHistory(raw_capacity=10, tiers=[(60, 4)])
+    for t in range(0, 600, 10):
+        series.add(1000 + t, t)
+    assert len(series) == 10
+
+    times, values = series.range(0, 10000)
+    assert list(times) == list(range(1500, 1600, 10))
+    assert list(values) == list(range(500, 600, 10))
+
+    times, values = series.range(1520, 1550)
+    assert list(times) == [1520, 1530, 1540]
+
+
+def test_series_downsampled():
+    series = SeriesHistory(raw_capacity=10, tiers=[(60, 4)])
+    for t in range(0, 600, 10):
+        series.add(1020 + t, t)
+    times, lo, hi, mean = series.range(0, 10000, resolution=60)
+    assert len(times) == 5
+    assert list(times) == [1320, 1380, 1440, 1500, 1560]
+    assert (lo[1], hi[1], mean[1]) == (360, 410, 385)
+    with pytest.raises(ValueError):
+        series.range(0, 10000, resolution=5)
+
+
+@pytest.mark.asyncio
+async def test_history_attach(mock_devices):
+    server, = await mock_devices(1)
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port)
+    try:
+        history = GeyserwalaHistory(keys=["tank-temp", "pump-status"])
+        history.attach(gw)
+        gw._cache_time = 0
+        await gw.update()
+        server.value["tank-temp"] += 1
+        server.value["pump-status"] = True
+        await gw.update()
+        _, values = history.range("tank-temp", 0, 2 ** 32 - 1)
+        assert list(values) == [45, 46]
+        _, values = history.range("pump-status", 0, 2 ** 32 - 1)
+        assert list(values) == [0, 1]
+    finally:
+        await gw.close()
@@ -0,0 +1,52 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import pytest
+
+from thingwala.geyserwala.poll import AdaptivePollInterval
+
+
+def test_adaptive_interval():
+    poll = AdaptivePollInterval(min_interval=2, max_interval=10, backoff=2, jitter=0)
+    assert [poll() for _ in range(4)] == [4, 8, 10, 10]
+
+    poll._on_change("setpoint", 50, 55)
+    assert poll() == 10
+    poll._on_change("tank-temp", None, 45)
+    assert poll() == 10
+    poll._on_change("tank-temp", 45, 46)
+    assert poll() == 2
+    assert poll() == 4
+
+
+def test_adaptive_interval_jitter():
+    poll = AdaptivePollInterval(min_interval=2, max_interval=10, backoff=1, jitter=0.5)
+    values = {poll() for _ in range(50)}
+    assert len(values) > 1
+    assert all(2 <= v <= 10 for v in values)
+
+
+def test_adaptive_interval_bounds():
+    with pytest.raises(ValueError):
+        AdaptivePollInterval(min_interval=10, max_interval=2)
+
+
+def test_adaptive_interval_attach():
+    class _Client:
+        def __init__(self):
+            self.subscriptions = []
+            self.listeners = []
+
+        def subscribe(self, key):
+            self.subscriptions.append(key)
+
+        def add_listener(self, callback):
+            self.listeners.append(callback)
+
+    client = _Client()
+    poll = AdaptivePollInterval(min_interval=2, max_interval=10, backoff=2, jitter=0)
+    assert poll.attach(client) is poll
+    assert "pump-status" in client.subscriptions
+    assert poll() == 4
+    client.listeners[0]("pump-status", False, True)
+    assert poll() == 2
@@ -0,0 +1,138 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import asyncio
+
+from types import SimpleNamespace
+
+import pytest
+
+from thingwala.geyserwala.aio.fleet import GeyserwalaFleetAsync
+from thingwala.geyserwala.aio.registry import (
+    REGISTRY_ADDED,
+    REGISTRY_REMOVED,
+    REGISTRY_UPDATED,
+    GeyserwalaRegistryAsync,
+)
+
+SERVICE = "_geyserwala._tcp.local."
+
+
+def _info(device_id, ip, port=80):
+    properties = {b"id": device_id.encode()} if device_id else {}
+    return SimpleNamespace(
+        properties=properties,
+        port=port,
+        server=f"gw-{device_id}.local.",
+        parsed_addresses=lambda: [ip],
+    )
+
+
+class _Zeroconf:
+    """Stands in for AsyncZeroconf, resolving names from a dict."""
+
+    def __init__(self):
+        self.infos = {}
+
+    async def async_get_service_info(self, _service_type, name):
+        return self.infos.get(name)
+
+
+async def _change(registry, name, state):
+    registry._on_change(SERVICE, name, state)
+    await asyncio.gather(*list(registry._tasks))
+
+
+@pytest.mark.asyncio
+async def test_registry_tracks_fleet():
+    fleet = GeyserwalaFleetAsync()
+    registry = GeyserwalaRegistryAsync(fleet, username="admin", password="pw")
+    zc = registry._aio_zc = _Zeroconf()
+    events = []
+    registry.add_listener(lambda event, device: events.append((event, device.id, device.ip)))
+    name = f"gw1.{SERVICE}"
+    try:
+        zc.infos[name] = _info("gw1", "10.0.0.5")
+        await _change(registry, name, "Added")
+        assert events == [(REGISTRY_ADDED, "gw1", "10.0.0.5")]
+        client = fleet.get("gw1")
+        assert client.address == ("10.0.0.5", 80)
+        assert registry.get("gw1").hostname == "gw-gw1.local."
+
+        # Same record again, nothing to report
+        await _change(registry, name, "Updated")
+        assert len(events) == 1
+
+        # New IP repoints the existing client
+        zc.infos[name] = _info("gw1", "10.0.0.9", port=8080)
+        await _change(registry, name, "Updated")
+        assert events[-1] == (REGISTRY_UPDATED, "gw1", "10.0.0.9")
+        assert fleet.get("gw1") is client
+        assert client.address == ("10.0.0.9", 8080)
+
+        await _change(registry, name, "Removed")
+        assert events[-1] == (REGISTRY_REMOVED, "gw1", "10.0.0.9")
+        assert "gw1" not in fleet
+        assert registry.devices == {}
+
+        # Unknown names are ignored
+        await _change(registry, name, "Removed")
+        assert len(events) == 3
+    finally:
+        await fleet.close()
+
+
+@pytest.mark.asyncio
+async def test_registry_ignores_unresolved():
+    registry = GeyserwalaRegistryAsync()
+    zc = registry._aio_zc = _Zeroconf()
+    events = []
+    registry.add_listener(lambda event, device: events.append(event))
+
+    await _change(registry, f"missing.{SERVICE}", "Added")
+    zc.infos[f"anon.{SERVICE}"] = _info(None, "10.0.0.7")
+    await _change(registry, f"anon.{SERVICE}", "Added")
+    assert events == [] and registry.devices == {}
+
+    # Without a fleet only the map and the listeners are kept current
+    zc.infos[f"gw2.{SERVICE}"] = _info("gw2", "10.0.0.8")
+    await _change(registry, f"gw2.{SERVICE}", "Added")
+    assert events == [REGISTRY_ADDED]
+    assert registry.get("gw2").ip == "10.0.0.8"
+
+
+@pytest.mark.asyncio
+async def test_registry_with_running_fleet(mock_devices):
+    first, second = await mock_devices(2)
+    gets = ("GET", "/api/value")
+    fleet = GeyserwalaFleetAsync()
+    registry = GeyserwalaRegistryAsync(fleet)
+    zc = registry._aio_zc = _Zeroconf()
+    zc.infos[f"gw1.{SERVICE}"] = _info("gw1", "127.0.0.1", first._port)
+    await _change(registry, f"gw1.{SERVICE}", "Added")
+
+    run = asyncio.ensure_future(fleet.run(interval=0.02))
+    try:
+        await asyncio.sleep(0.1)
+        assert first.requests[gets] > 0
+
+        # Added while running, picked up without a restart
+        zc.infos[f"gw2.{SERVICE}"] = _info("gw2", "127.0.0.1", second._port)
+        await _change(registry, f"gw2.{SERVICE}", "Added")
+        await asyncio.sleep(0.1)
+        assert second.requests[gets] > 0
+
+        client = fleet.get("gw1")
+        closed = []
+        close = client.close
+        client.close = lambda: closed.append(client) or close()
+        await _change(registry, f"gw1.{SERVICE}", "Removed")
+        assert closed == [client]
+        polled = first.requests[gets]
+        await asyncio.sleep(0.1)
+        assert first.requests[gets] == polled
+        assert not run.done()
+    finally:
+        run.cancel()
+        await asyncio.gather(run, return_exceptions=True)
+        await fleet.close()
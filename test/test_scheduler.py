@@ -0,0 +1,63 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import asyncio
+import time
+
+import pytest
+
+from thingwala.geyserwala.aio.scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_READ,
+    RequestScheduler,
+)
+
+
+@pytest.mark.asyncio
+async def test_priority_order():
+    scheduler = RequestScheduler(max_concurrency=1)
+    order = []
+
+    async def _request(name, priority):
+        async with scheduler.slot(priority):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    blocker = asyncio.ensure_future(_request("first", PRIORITY_BACKGROUND))
+    await asyncio.sleep(0)
+    tasks = [
+        asyncio.ensure_future(_request("poll-1", PRIORITY_BACKGROUND)),
+        asyncio.ensure_future(_request("read", PRIORITY_READ)),
+        asyncio.ensure_future(_request("poll-2", PRIORITY_BACKGROUND)),
+        asyncio.ensure_future(_request("write", PRIORITY_INTERACTIVE)),
+    ]
+    await asyncio.sleep(0)
+    assert scheduler.pending == 4
+    await asyncio.gather(blocker, *tasks)
+    assert order == ["first", "write", "read", "poll-1", "poll-2"]
+    assert scheduler.active == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter():
+    scheduler = RequestScheduler(max_concurrency=1)
+    await scheduler.acquire()
+    waiter = asyncio.ensure_future(scheduler.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    scheduler.release()
+    await asyncio.wait_for(scheduler.acquire(), 1)
+    assert scheduler.active == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limit():
+    scheduler = RequestScheduler(max_concurrency=10, rate=50, burst=2)
+    t0 = time.perf_counter()
+    for _ in range(7):
+        async with scheduler.slot():
+            pass
+    # 2 from the burst, 5 more at 50/s
+    assert 0.08 <= time.perf_counter() - t0 < 0.5
@@ -0,0 +1,85 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import math
+
+import pytest
+
+from thingwala.geyserwala.aio.client import GeyserwalaClientAsync
+from thingwala.geyserwala.errors import TelemetryError
+from thingwala.geyserwala.telemetry import TelemetryLog, TelemetryReader, TelemetryWriter
+
+
+def test_telemetry_roundtrip(tmp_path):
+    path = tmp_path / "dev.gwtl"
+    with TelemetryWriter(path, ["tank-temp", "pump-status"], block_rows=4) as writer:
+        for t in range(10):
+            writer.append(1000 + t, {"tank-temp": 40 + t, "pump-status": t % 2 == 0})
+
+    with TelemetryWriter(path, ["tank-temp", "setpoint"], block_rows=4) as writer:
+        assert writer.keys == ["tank-temp", "pump-status", "setpoint"]
+        writer.append(1010, {"tank-temp": 50, "setpoint": 60})
+
+    with TelemetryReader(path) as reader:
+        assert reader.keys == ["tank-temp", "pump-status", "setpoint"]
+        times, values = reader.range("tank-temp")
+        assert list(times) == list(range(1000, 1011))
+        assert list(values) == list(range(40, 51))
+
+        times, values = reader.range("setpoint", 1005)
+        assert list(times) == [1010]
+        assert list(values) == [60]
+
+        times, values = reader.range("pump-status", 1003, 1006)
+        assert list(times) == [1003, 1004, 1005]
+        assert list(values) == [0, 1, 0]
+
+        blocks = list(reader.scan(1008, 1011))
+        assert [list(b[0]) for b in blocks] == [[1008, 1009], [1010]]
+        assert math.isnan(blocks[1][1]["pump-status"][0])
+        del blocks
+
+
+def test_telemetry_truncated_tail(tmp_path):
+    path = tmp_path / "dev.gwtl"
+    with TelemetryWriter(path, ["tank-temp"], block_rows=2) as writer:
+        for t in range(4):
+            writer.append(t, {"tank-temp": t})
+    with open(path, "ab") as f:
+        f.write(b"DATA\xff")
+
+    with TelemetryReader(path) as reader:
+        assert len(reader.range("tank-temp")[0]) == 4
+    with TelemetryWriter(path, ["tank-temp"]) as writer:
+        writer.append(4, {"tank-temp": 4})
+    with TelemetryReader(path) as reader:
+        assert list(reader.range("tank-temp")[1]) == [0, 1, 2, 3, 4]
+
+
+def test_telemetry_bad_file(tmp_path):
+    path = tmp_path / "bad.gwtl"
+    path.write_bytes(b"NOPE" + b"\0" * 60)
+    with pytest.raises(TelemetryError):
+        TelemetryReader(path)
+
+
+@pytest.mark.asyncio
+async def test_telemetry_log_attach(mock_devices, tmp_path):
+    server, = await mock_devices(1)
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port)
+    log = TelemetryLog(tmp_path)
+    try:
+        log.attach(gw)
+        gw.subscribe("setpoint")
+        gw._cache_time = 0
+        await gw.update()
+        await gw.update()
+    finally:
+        log.close()
+        await gw.close()
+
+    with TelemetryReader(log.path(server.value["id"], gw.last_update)) as reader:
+        assert "tank-temp" in reader.keys
+        assert "setpoint" in reader.keys
+        assert "mode" not in reader.keys
+        assert list(reader.range("setpoint")[1]) == [server.value["setpoint"]] * 2
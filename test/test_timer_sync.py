@@ -0,0 +1,106 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import pytest
+
+from thingwala.geyserwala.aio.client import GeyserwalaClientAsync
+from thingwala.geyserwala.errors import RequestError
+from thingwala.geyserwala.timer import (
+    TIMER_OP_ADD,
+    TIMER_OP_DELETE,
+    TIMER_OP_UPDATE,
+    Timer,
+    diff_timers,
+)
+
+
+def test_timer_json():
+    blob = {'id': 3, 'begin': [12, 34], 'end': [13, 45], 'temp': 33, 'dow': [False, False, False, True, False, False, True]}
+    timer = Timer.from_json(blob)
+    assert timer.begin == 12 * 60 + 34
+    assert timer.dow == 0b1001000
+    assert timer.to_json() == blob
+    assert timer == timer.with_id(7)
+    assert hash(timer) == hash(timer.with_id(7))
+
+
+def test_diff_timers():
+    a = Timer(60, 120, 50, 0b1111111, id=1)
+    b = Timer(300, 360, 55, 0b0011111, id=2)
+    c = Timer(600, 660, 60, 0b1100000, id=3)
+    d = Timer(900, 960, 45, 0b0000001)
+    e = Timer(1000, 1060, 45, 0b0000010)
+
+    assert not diff_timers([a, b, c], [c, b, a])
+
+    ops = diff_timers([a, b, c], [a, d])
+    assert [(op.action, op.timer.id) for op in ops] == [
+        (TIMER_OP_UPDATE, 2),
+        (TIMER_OP_DELETE, 3),
+    ]
+    assert ops[0].timer == d
+
+    ops = diff_timers([a], [a, d, e])
+    assert [(op.action, op.timer) for op in ops] == [
+        (TIMER_OP_ADD, d),
+        (TIMER_OP_ADD, e),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_sync_timers(mock_devices):
+    server, = await mock_devices(1)
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port)
+    lists = ("GET", "/api/value/timer")
+    try:
+        await gw.add_timer({'begin': [6, 0], 'end': [7, 0], 'temp': 60, 'dow': [True] * 7})
+        await gw.add_timer({'begin': [18, 0], 'end': [19, 0], 'temp': 55, 'dow': [True] * 7})
+
+        desired = [
+            Timer.from_json({'begin': [6, 0], 'end': [7, 0], 'temp': 60, 'dow': [True] * 7}),
+            Timer.from_json({'begin': [17, 0], 'end': [18, 0], 'temp': 55, 'dow': [True] * 5 + [False] * 2}),
+            Timer.from_json({'begin': [21, 0], 'end': [22, 0], 'temp': 50, 'dow': [False] * 5 + [True] * 2}),
+        ]
+        ops = await gw.sync_timers(desired)
+        assert [op.action for op in ops] == [TIMER_OP_UPDATE, TIMER_OP_ADD]
+        assert all(op.ok for op in ops)
+        assert sorted(Timer.from_json(t).begin for t in server.timers.values()) == [360, 1020, 1260]
+        assert server.requests[lists] == 1
+
+        # Served from the cached table, no re-list
+        assert not await gw.sync_timers(desired)
+        assert server.requests[lists] == 1
+
+        ops = await gw.sync_timers(desired[:1])
+        assert [op.action for op in ops] == [TIMER_OP_DELETE, TIMER_OP_DELETE]
+        assert len(server.timers) == 1
+        assert gw.timers == desired[:1]
+    finally:
+        await gw.close()
+
+
+@pytest.mark.asyncio
+async def test_sync_timers_relists_after_failure(mock_devices):
+    server, = await mock_devices(1)
+    gw = GeyserwalaClientAsync("127.0.0.1", port=server._port)
+    lists = ("GET", "/api/value/timer")
+    try:
+        morning = Timer(360, 420, 60, 0b1111111)
+        evening = Timer(1080, 1140, 55, 0b1111111)
+        assert all(op.ok for op in await gw.sync_timers([morning, evening]))
+        assert server.requests[lists] == 1
+
+        # Changed behind the client's back, the cached delete then fails
+        server.timers.clear()
+        ops = await gw.sync_timers([morning])
+        assert [op.action for op in ops] == [TIMER_OP_DELETE]
+        assert not ops[0].ok and isinstance(ops[0].error, RequestError)
+        assert gw.timers is None
+
+        ops = await gw.sync_timers([morning])
+        assert server.requests[lists] == 2
+        assert [op.action for op in ops] == [TIMER_OP_ADD] and ops[0].ok
+        assert gw.timers == [morning]
+        assert [Timer.from_json(t) for t in server.timers.values()] == [morning]
+    finally:
+        await gw.close()
@@ -6,7 +6,11 @@ import logging
 import sys
 
 from thingwala.geyserwala.aio.client import GeyserwalaClientAsync
-from thingwala.geyserwala.aio.discovery import GeyserwalaDiscoveryAsync
+from thingwala.geyserwala.aio.discovery import (
+    GeyserwalaDiscoveryAsync,
+    GeyserwalaDiscoveryCache,
+)
+from thingwala.geyserwala.errors import Unauthorized
 
 
 root = logging.getLogger()
@@ -21,25 +25,24 @@ root.addHandler(handler)
 
 async def status(ip, username="admin", password=""):
     gw = GeyserwalaClientAsync(ip, username, password)
+    for key in ["pump-status", "collector-temp", "boost-demand", "setpoint"]:
+        gw.subscribe(key)
     try:
-        while True:
-            await gw.update_status()
-            if not gw.authorized:
-                return
+        async for values in gw.watch(interval=2):
             print("---")
             print(f"Geyserwala [{ip}]")
-            print(f"Name: {gw.name}")
-            print(f"Status: {gw.status}")
-            pump = "RUNNING" if gw.pump_status else "STOPPED"
+            print(f"Name: {values.get('name')}")
+            print(f"Status: {values.get('status')}")
+            pump = "RUNNING" if values.get("pump-status") else "STOPPED"
             print(
-                f"Water: {gw.tank_temp}  Collector: {gw.collector_temp}  Pump: {pump}"
+                f"Water: {values.get('tank-temp')}  Collector: {values.get('collector-temp')}  Pump: {pump}"
             )
-            boost = "YES" if gw.boost_demand else "NO "
-            element = "ON" if gw.element_demand else "OFF"
-            print(f"Boost: {boost}  Setpoint: {gw.setpoint}  Element: {element}")
-            print("Mode:", gw.mode)
-
-            await asyncio.sleep(2)
+            boost = "YES" if values.get("boost-demand") else "NO "
+            element = "ON" if values.get("element-demand") else "OFF"
+            print(f"Boost: {boost}  Setpoint: {values.get('setpoint')}  Element: {element}")
+            print("Mode:", values.get("mode"))
+    except Unauthorized:
+        print("Unauthorized")
     finally:
         await gw.close()
 
@@ -55,19 +58,27 @@ async def timers(ip, username="admin", password=""):
         await gw.close()
 
 
-async def discover():
+async def discover(cache_path=None, username="admin", password=""):
     gw = GeyserwalaDiscoveryAsync()
-    return await gw.mdns_discover()
+    if cache_path:
+        # Cached devices are confirmed by logging in and reading their id
+        devices = await gw.cached_discover(
+            GeyserwalaDiscoveryCache(cache_path), username=username, password=password
+        )
+        for device in devices:
+            print(device)
+    else:
+        devices = []
+        async for device in gw.mdns_stream():
+            devices.append(device)
+            print(device)
+    if not devices:
+        print("None found")
 
 
 async def main(args):
     if args[0] == "discover":
-        res = await discover()
-        if not res:
-            print("None found")
-        else:
-            for r in res:
-                print(r)
+        await discover(*args[1:])
     elif args[0] == "status":
         await status(*args[1:])
     elif args[0] == "timers":
@@ -3,14 +3,25 @@
 ####################################################################################
 import asyncio
 import logging
+import math
+import random
 import time
 
-from contextlib import asynccontextmanager
-from copy import deepcopy
+from types import MappingProxyType
+from contextlib import AsyncExitStack, asynccontextmanager
 
 import aiohttp
 
+from thingwala.geyserwala.aio.health import DeviceHealth
+from thingwala.geyserwala.aio.metrics import ClientMetrics
+from thingwala.geyserwala.aio.scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_READ,
+    RequestScheduler,
+)
 from thingwala.geyserwala.const import (
+    GEYSERWALA_FEATURE_KEYS,
     GEYSERWALA_MODES,
     GEYSERWALA_MODE_SETPOINT,
     GEYSERWALA_MODE_TIMER,
@@ -18,25 +29,76 @@ from thingwala.geyserwala.const import (
     GEYSERWALA_MODE_STANDBY,
     GEYSERWALA_MODE_HOLIDAY,
 )
-from thingwala.geyserwala.errors import RequestError, Unauthorized
+from thingwala.geyserwala.errors import (
+    CircuitOpen,
+    GeyserwalaException,
+    RequestError,
+    Unauthorized,
+)
+from thingwala.geyserwala.state import GeyserwalaState
+from thingwala.geyserwala.timer import (
+    TIMER_OP_DELETE,
+    TIMER_OP_UPDATE,
+    Timer,
+    diff_timers,
+)
 
 logger = logging.getLogger(__name__)
 
+# Safe to send twice, POST creates a timer each time
+_RETRY_METHODS = ("GET", "PUT", "PATCH", "DELETE")
+# Causes of a RequestError that mean the device was not reached
+_TRANSPORT_ERRORS = (asyncio.TimeoutError, aiohttp.ClientConnectionError)
+
+
+class _Flight:
+    def __init__(self, keys, priority):
+        self.keys = dict.fromkeys(keys)
+        self.priority = priority
+        self.sent = False
+        self.task = None
+
+    def covers(self, keys):
+        return all(k in self.keys for k in keys)
+
 
 class GeyserwalaClientAsync:
-    _base_keys = [
+    # Static keys are fetched once per session, dynamic keys on every poll.
+    _static_keys = [
         "id",
         "name",
         "version",
         "features",
+    ]
+    _dynamic_keys = [
         "status",
         "mode",
         "tank-temp",
         "element-demand",
     ]
+    _base_keys = _static_keys + _dynamic_keys
 
     def __init__(
-        self, host, username=None, password=None, port=80, session=None
+        self,
+        host,
+        username=None,
+        password=None,
+        port=80,
+        session=None,
+        max_connections=2,
+        device_id=None,
+        capabilities=None,
+        write_debounce=0,
+        state_store=None,
+        metrics=False,
+        tracer=None,
+        connect_timeout=2,
+        read_timeout=5,
+        retries=1,
+        retry_backoff=0.1,
+        health=None,
+        rate_limit=None,
+        max_stale=60,
     ) -> None:
         self._scheme = "http"
         self._host = host
@@ -44,19 +106,109 @@ class GeyserwalaClientAsync:
         self._user = username or "admin"
         self._pass = password or ""
         self._rest_timeout = 10
-        self._lock = asyncio.Lock()
-        self._session = session or aiohttp.ClientSession()
-        self._values = {}
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._health = DeviceHealth() if health is None else health
+        self._scheduler = RequestScheduler(max_connections, rate=rate_limit)
+        self._write_locks = {}
+        self._metrics = ClientMetrics() if metrics is True else (metrics or None)
+        self._tracer = tracer
+        # A session passed in is shared, its owner closes it
+        self._own_session = session is None
+        if session is None:
+            trace_configs = [tracer.trace_config] if tracer is not None else None
+            session = aiohttp.ClientSession(trace_configs=trace_configs)
+        elif tracer is not None and not tracer.traces(session):
+            raise ValueError(
+                "Create a shared session with trace_configs=[tracer.trace_config] to trace it"
+            )
+        self._session = session
+        self._token = None
+        self._login_task = None
+        # Device values, typed fields for the known keys
+        self._state = GeyserwalaState()
         self._last_update = 0
         self._cache_time = 0.5
+        self._ttls = dict.fromkeys(self._static_keys, math.inf)
+        self._fetched = {}
         self._subscriptions = []
+        self._flight = None
+        self._max_stale = max_stale
+        self._revalidation = None
+        self._listeners = {}
+        self._update_listeners = []
+        self._timers = None
+        self._write_debounce = write_debounce
+        self._pending_writes = None
+        self._pending_flush = None
+        self._capabilities = {} if capabilities is None else capabilities
+        self._store = state_store
+        self._store_key = device_id or f"{host}:{port}"
+        if self._store is not None:
+            self._restore()
+        if device_id in self._capabilities:
+            self._state = self._state.merge(self._capabilities[device_id])
+
+    def _restore(self):
+        state = self._store.get(self._store_key)
+        if not state:
+            return
+        self._state = self._state.merge(state.get("values", {}))
+        capabilities = state.get("capabilities")
+        if capabilities:
+            self._capabilities.setdefault(capabilities.get("id"), capabilities)
+            self._state = self._state.merge(capabilities)
+        self._token = state.get("token")
+        if self._token is not None and capabilities:
+            # Same session as when saved, so the static keys still hold
+            self._fetched.update(dict.fromkeys(capabilities, self._now()))
+
+    def save_state(self):
+        if self._store is None:
+            return
+        self._store.put(
+            self._store_key,
+            token=self._token,
+            capabilities=self._capabilities.get(self._state.id),
+            values=self._snapshot(self._dynamic_keys + self._subscriptions).copy(),
+        )
 
     async def close(self):
-        await self._session.close()
+        if self._revalidation is not None:
+            self._revalidation.cancel()
+        self.save_state()
+        if self._own_session:
+            await self._session.close()
+
+    @property
+    def address(self):
+        return self._host, self._port
+
+    def set_address(self, host, port=80):
+        if (host, port) != (self._host, self._port):
+            logger.debug("Device moved from %s:%s to %s:%s", self._host, self._port, host, port)
+            self._host = host
+            self._port = port
+
+    @property
+    def health(self):
+        return self._health
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def stats(self):
+        # Metrics snapshot, None unless the client was created with metrics
+        if self._metrics is None:
+            return None
+        return self._metrics.snapshot()
 
     @property
     def authorized(self):
-        return getattr(self._session, "_token", None) is not None
+        return self._token is not None
 
     async def _value_callback(self, value):
         if asyncio.iscoroutinefunction(value):
@@ -70,46 +222,136 @@ class GeyserwalaClientAsync:
         self._pass = password
         password = await self._value_callback(self._pass)
         rsp = await self._json_req(
-            "POST", "api/session", json={"username": self._user, "password": password}
+            "POST",
+            "api/session",
+            json={"username": self._user, "password": password},
+            priority=PRIORITY_INTERACTIVE,
         )
         if not rsp:
-            self._session._token = None
+            self._token = None
             return False
         try:
             if rsp["success"] is True:
-                self._session._token = rsp["token"]
+                self._token = rsp["token"]
+                self._invalidate(self._static_keys)
+                if self._store is not None:
+                    self._store.put(self._store_key, token=self._token)
                 return True
         except KeyError as ex:
             logger.warning("Malformed response to auth request: %s", ex)
         return False
 
     async def logout(self):
-        rsp = await self._json_req("DELETE", "api/session")
+        rsp = await self._json_req("DELETE", "api/session", priority=PRIORITY_INTERACTIVE)
         if not rsp:
             return False
         if rsp["success"] is True:
-            self._session._token = None
+            self._token = None
             return True
         return False
 
     @asynccontextmanager
     async def _auth(self):
         if not self.authorized:
-            if not await self.login(self._user, self._pass):
+            # Concurrent callers share one login
+            if self._login_task is None:
+                self._login_task = asyncio.ensure_future(self.login(self._user, self._pass))
+                self._login_task.add_done_callback(self._login_done)
+            if not await asyncio.shield(self._login_task):
                 raise Unauthorized()
         yield
 
-    async def _json_req(self, method: str, path: str, params=None, json=None):
+    def _login_done(self, task):
+        if self._login_task is task:
+            self._login_task = None
+        if not task.cancelled():
+            task.exception()
+
+    @asynccontextmanager
+    async def _write_lock(self, keys):
+        # Reads run concurrently, writes to the same key are serialized. Locks
+        # are taken in sorted order so multi-key writes cannot deadlock.
+        async with AsyncExitStack() as stack:
+            for key in sorted(set(keys)):
+                lock = self._write_locks.setdefault(key, asyncio.Lock())
+                await stack.enter_async_context(lock)
+            yield
+
+    async def _json_req(
+        self, method: str, path: str, params=None, json=None, priority=PRIORITY_READ
+    ):
+        if self._metrics is None:
+            return await self._send(method, path, params, json, priority)
+        t0 = time.perf_counter()
+        try:
+            rsp = await self._send(method, path, params, json, priority)
+        except GeyserwalaException as ex:
+            self._metrics.record_request(method, path, time.perf_counter() - t0, ex)
+            raise
+        self._metrics.record_request(method, path, time.perf_counter() - t0)
+        return rsp
+
+    async def _send(
+        self, method: str, path: str, params=None, json=None, priority=PRIORITY_READ
+    ):
+        # Fails fast while the device's circuit is open. Requests that did not
+        # reach the device are retried with backoff, within the retry budget.
+        attempt = 0
+        while True:
+            ticket = self._health.allow()
+            if not ticket:
+                raise CircuitOpen(
+                    f"{self._host}:{self._port} unreachable, "
+                    f"next try in {self._health.retry_after:.1f}s"
+                )
+            reached = True
+            try:
+                return await self._attempt(method, path, params, json, priority)
+            except RequestError as ex:
+                if not isinstance(ex.__cause__, _TRANSPORT_ERRORS):
+                    raise
+                reached = False
+                self._health.record_failure(ex, ticket)
+                if not self._may_retry(method, attempt):
+                    raise
+            except GeyserwalaException:
+                raise
+            except BaseException:
+                reached = False
+                self._health.release(ticket)
+                raise
+            finally:
+                if reached:
+                    self._health.record_success()
+            attempt += 1
+            delay = self._retry_backoff * 2 ** (attempt - 1)
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+
+    def _may_retry(self, method, attempt):
+        if attempt >= self._retries or method not in _RETRY_METHODS:
+            return False
+        return self._health.can_retry()
+
+    async def _attempt(
+        self, method: str, path: str, params=None, json=None, priority=PRIORITY_READ
+    ):
         params = params or {}
         logger.debug("req: %s %s %s %s", method, path, params, json)
+        trace = None
+        if self._tracer is not None:
+            device = self._state.id or f"{self._host}:{self._port}"
+            trace = self._tracer.start(device, method, path)
         try:
-            async with self._lock:
+            async with self._scheduler.slot(priority):
+                if trace is not None:
+                    self._tracer.dequeued(trace)
                 headers = {
                     "Content-Type": "application/json",
                     "Accept": "application/json",
                 }
-                if hasattr(self._session, "_token"):
-                    headers["Authorization"] = f"Bearer {self._session._token}"
+                token = self._token
+                if token is not None:
+                    headers["Authorization"] = f"Bearer {token}"
 
                 url = f"{self._scheme}://{self._host}:{self._port}/{path}"
                 async with self._session.request(
@@ -118,9 +360,16 @@ class GeyserwalaClientAsync:
                     url=url,
                     params=params,
                     json=json,
-                    timeout=self._rest_timeout,
+                    timeout=aiohttp.ClientTimeout(
+                        total=self._rest_timeout,
+                        sock_connect=self._connect_timeout,
+                        sock_read=self._read_timeout,
+                    ),
+                    trace_request_ctx=trace,
                 ) as rsp:
                     status = rsp.status
+                    if self._metrics is not None:
+                        self._metrics.record_response(status, rsp.content_length)
                     if status == 200:
                         json_blob = await rsp.json()
                         return json_blob
@@ -144,85 +393,357 @@ class GeyserwalaClientAsync:
                 "Non-aiohttp exception occured:  %s", ex
             )
             raise RequestError from ex
+        finally:
+            if trace is not None:
+                self._tracer.finish(trace)
         if status == 401:
-            if hasattr(self._session, "_token"):
-                delattr(self._session, "_token")
+            # Leave a token from a concurrent re-login in place
+            if self._token == token:
+                self._token = None
             raise Unauthorized()
         raise RequestError(f"Unexpected status: {status}")
 
-    def subscribe(self, key):
+    def subscribe(self, key, ttl=None):
         if key not in self._subscriptions:
             self._subscriptions.append(key)
+        if ttl is not None:
+            self.set_ttl(key, ttl)
+
+    def set_ttl(self, key, ttl):
+        # Seconds a fetched value stays fresh, math.inf to fetch it only once,
+        # None to fall back to the client wide cache time.
+        if ttl is None:
+            self._ttls.pop(key, None)
+        else:
+            self._ttls[key] = ttl
+
+    def _invalidate(self, keys):
+        for key in keys:
+            self._fetched.pop(key, None)
+
+    def _supported(self, key):
+        features = self._state.features
+        required = GEYSERWALA_FEATURE_KEYS.get(key)
+        if not features or not required:
+            return True
+        return any(self._state.has_feature(f) for f in required)
+
+    def _stale_keys(self, keys, now):
+        stale = []
+        for key in keys:
+            fetched = self._fetched.get(key)
+            if fetched is None or (fetched + self._ttls.get(key, self._cache_time)) <= now:
+                stale.append(key)
+        return stale
 
     def unsubscribe(self, key):
         if key in self._base_keys:
             return
         self._subscriptions.remove(key)
+        self._fetched.pop(key, None)
+        self._state = self._state.without(key)
 
-    async def update(self):
+    @property
+    def polled_keys(self):
         keys = list(self._base_keys)
-        keys.extend(self._subscriptions)
-        return await self._update_keys(keys)
-
-    async def _update_keys(self, keys):
+        keys.extend(k for k in self._subscriptions if self._supported(k))
+        return keys
+
+    async def update(self, priority=PRIORITY_READ):
+        # Pollers pass PRIORITY_BACKGROUND so they queue behind user requests
+        return await self._update_keys(self.polled_keys, priority)
+
+    async def watch(self, keys=None, interval=2):
+        # Polls in the background and yields read-only snapshots. A consumer
+        # that falls behind gets the latest snapshot, intermediate ones are dropped.
+        # interval is in seconds, or a callable returning the next one.
+        latest = None
+        error = None
+        ready = asyncio.Event()
+
+        async def _poll():
+            nonlocal latest, error
+            try:
+                while True:
+                    try:
+                        if keys is None:
+                            ok = await self.update(PRIORITY_BACKGROUND)
+                        else:
+                            ok = await self._update_keys(list(keys), PRIORITY_BACKGROUND)
+                    except RequestError as ex:
+                        logger.debug("watch: update failed: %s", ex)
+                        ok = False
+                    if ok:
+                        latest = self._snapshot(keys)
+                        ready.set()
+                    await asyncio.sleep(interval() if callable(interval) else interval)
+            except Exception as ex:
+                error = ex
+                ready.set()
+
+        task = asyncio.ensure_future(_poll())
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                if error is not None:
+                    raise error
+                yield latest
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def _snapshot(self, keys=None):
+        if keys is None:
+            keys = self._base_keys + self._subscriptions
+        values = {}
+        for key in keys:
+            value = self._state.get(key)
+            if value is not None:
+                values[key] = value
+        return MappingProxyType(values)
+
+    def _ages(self, keys, now):
+        # Seconds since each key was fetched, keys fetched once a session
+        # don't count
+        ages = {}
+        for key in keys:
+            if self._ttls.get(key) == math.inf:
+                continue
+            fetched = self._fetched.get(key)
+            ages[key] = math.inf if fetched is None else now - fetched
+        return ages
+
+    def _age(self, keys, now):
+        return max(self._ages(keys, now).values(), default=0)
+
+    def _revalidate(self, keys, now):
+        # One background refresh at a time, shared by all stale readers
+        stale = self._stale_keys(keys, now)
+        if not stale or self._revalidation is not None:
+            return
+        if self._metrics is not None:
+            self._metrics.record_cache("stale")
+        self._revalidation = asyncio.ensure_future(self._fetch(stale))
+        self._revalidation.add_done_callback(self._revalidated)
+
+    def _revalidated(self, task):
+        if self._revalidation is task:
+            self._revalidation = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("Background refresh failed: %r", task.exception())
+
+    def peek(self, key):
+        # Cached (value, age in seconds) without waiting. A value past its
+        # freshness window starts a background refresh.
         now = self._now()
-        if (self._last_update + self._cache_time) > now:
+        self._revalidate([key], now)
+        return self._state.get(key), self._age([key], now)
+
+    async def read(self, keys=None, max_stale=None):
+        # Stale-while-revalidate (state, age in seconds) of keys, the polled
+        # keys by default. Returns the cached state right away unless it is
+        # older than max_stale, then waits for a refresh.
+        keys = self.polled_keys if keys is None else list(keys)
+        max_stale = self._max_stale if max_stale is None else max_stale
+        now = self._now()
+        expired = [k for k, age in self._ages(keys, now).items() if age > max_stale]
+        if expired:
+            # Past the hard limit whatever the key's own freshness window
+            await self._fetch(expired)
+            now = self._now()
+        else:
+            self._revalidate(keys, now)
+        return self._state, self._age(keys, now)
+
+    async def _update_keys(self, keys, priority=PRIORITY_READ):
+        stale = self._stale_keys(keys, self._now())
+        if self._metrics is not None:
+            self._metrics.record_cache("miss" if stale else "hit")
+        if not stale:
             return True
+        return await self._fetch(stale, priority)
+
+    async def _fetch(self, keys, priority=PRIORITY_READ):
+        # Concurrent refreshes share one in-flight GET. Callers arriving before
+        # it is sent add their keys to it, later ones join it if it covers them.
+        flight = self._flight
+        if flight is None or (flight.sent and not flight.covers(keys)):
+            flight = _Flight(keys, priority)
+            self._flight = flight
+            flight.task = asyncio.ensure_future(self._fly(flight))
+            # Waiters may all be cancelled, don't leave the error unretrieved
+            flight.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            if not flight.sent:
+                flight.keys.update(dict.fromkeys(keys))
+                flight.priority = min(flight.priority, priority)
+            if self._metrics is not None:
+                self._metrics.record_cache("coalesced")
+        return await asyncio.shield(flight.task)
+
+    async def _fly(self, flight):
+        try:
+            await asyncio.sleep(0)
+            flight.sent = True
+            now = self._now()
+            async with self._auth():
+                # A (re)login invalidates the static keys, pick them up here
+                flight.keys.update(dict.fromkeys(self._stale_keys(self._static_keys, now)))
+                rsp = await self._json_req(
+                    "GET",
+                    "api/value",
+                    params={"f": ",".join(flight.keys)},
+                    priority=flight.priority,
+                )
+                if rsp:
+                    self._merge(rsp)
+                    self._fetched.update(dict.fromkeys(flight.keys, now))
+                    self._last_update = now
+                    if "id" in rsp:
+                        self._capabilities[rsp["id"]] = dict(self._snapshot(self._static_keys))
+                    if self._update_listeners:
+                        self._notify_update()
+                    return True
+                return False
+        finally:
+            if self._flight is flight:
+                self._flight = None
+
+    def add_listener(self, callback, key=None):
+        # callback(key, old, new) for changed values of key, or of any key if None.
+        # Returns a function that removes the listener.
+        self._listeners.setdefault(key, []).append(callback)
+
+        def _remove():
+            self._listeners[key].remove(callback)
+
+        return _remove
+
+    def add_update_listener(self, callback):
+        # callback(client) after every successful poll, changed or not.
+        # Returns a function that removes the listener.
+        self._update_listeners.append(callback)
+
+        def _remove():
+            self._update_listeners.remove(callback)
+
+        return _remove
+
+    def _notify_update(self):
+        for callback in list(self._update_listeners):
+            try:
+                callback(self)
+            except Exception:
+                logger.exception("Update listener failed")
+
+    def _merge(self, values):
+        old_state = self._state
+        self._state = old_state.merge(values)
+        if self._state is old_state:
+            return []
+        changes = []
+        for key in values:
+            old = old_state.get(key)
+            new = self._state.get(key)
+            if old is None or old != new:
+                changes.append((key, old, new))
+        if changes and self._listeners:
+            self._notify(changes)
+        return changes
+
+    def _notify(self, changes):
+        wildcard = self._listeners.get(None, ())
+        for key, old, new in changes:
+            for callback in [*self._listeners.get(key, ()), *wildcard]:
+                try:
+                    callback(key, old, new)
+                except Exception:
+                    logger.exception("Listener failed on %s", key)
 
-        async with self._auth():
-            rsp = await self._json_req("GET", "api/value", params={"f": ",".join(keys)})
-            if rsp:
-                self._values.update(rsp)
-                self._last_update = now
-                return True
-            return False
+    @property
+    def last_update(self):
+        return self._last_update
+
+    @property
+    def state(self):
+        # Immutable snapshot, replaced whenever a poll or write changes a value
+        return self._state
 
     def _now(self):
         return time.time()
 
+    async def _set_values(self, values):
+        async with self._write_lock(values), self._auth():
+            ret = await self._json_req(
+                "PATCH", "api/value", json=values, priority=PRIORITY_INTERACTIVE
+            )
+            ret = ret or {}
+            accepted = {k: ret[k] for k, v in values.items() if k in ret and ret[k] == v}
+            if accepted:
+                self._merge(accepted)
+                self._fetched.update(dict.fromkeys(accepted, self._now()))
+            return {k: k in accepted for k in values}
+
     async def _set_value(self, key, value):
-        async with self._auth():
-            ret = await self._json_req("PATCH", "api/value", json={key: value})
-            if ret and ret[key] == value:
-                self._values.update(ret)
-                return True
-            return False
+        return (await self._set_values({key: value}))[key]
+
+    async def _flush_writes(self):
+        await asyncio.sleep(self._write_debounce)
+        values, self._pending_writes = self._pending_writes, None
+        return await self._set_values(values)
+
+    async def _debounced_set_values(self, values):
+        # Writes within the window from the first one go out as one PATCH,
+        # the last value written to a key wins.
+        if self._pending_writes is None:
+            self._pending_writes = {}
+            self._pending_flush = asyncio.ensure_future(self._flush_writes())
+            self._pending_flush.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._pending_writes.update(values)
+        ret = await asyncio.shield(self._pending_flush)
+        return {k: ret[k] for k in values}
 
     def get_value(self, key):
-        return self._values.get(key)
+        return self._state.get(key)
 
     async def set_value(self, key, value):
+        if self._write_debounce > 0:
+            return (await self._debounced_set_values({key: value}))[key]
         return await self._set_value(key, value)
 
+    async def set_values(self, values: dict):
+        # Joins pending debounced writes, so the last write to a key still wins
+        if self._write_debounce > 0:
+            return await self._debounced_set_values(dict(values))
+        return await self._set_values(dict(values))
+
     @property
     def id(self):
-        return self._values.get("id", "?")
+        return self._state.get("id", "?")
 
     @property
     def name(self):
-        return self._values.get("name", "?")
+        return self._state.get("name", "?")
 
     @property
     def version(self):
-        return self._values.get("version", "?")
+        return self._state.get("version", "?")
 
     def has_feature(self, key):
-        try:
-            return self._values.get("features", {})[key]
-        except KeyError:
-            return False
+        return self._state.has_feature(key)
 
     @property
     def status(self):
-        return self._values.get("status", "?")
+        return self._state.get("status", "?")
 
     @property
     def tank_temp(self):
-        return self._values.get("tank-temp", -25)
+        return self._state.get("tank-temp", -25)
 
     @property
     def element_demand(self):
-        return self._values.get("element-demand", False)
+        return self._state.get("element-demand", False)
 
     @property
     def modes(self):
@@ -238,23 +759,33 @@ class GeyserwalaClientAsync:
 
     @property
     def mode(self):
-        return self._values.get("mode", "?")
+        return self._state.get("mode", "?")
 
     async def set_mode(self, mode: str):
         if mode in GEYSERWALA_MODES:
-            return await self._set_value("mode", mode)
+            return await self.set_value("mode", mode)
         return False
 
+    def _cache_timer(self, blob):
+        if self._timers is not None:
+            timer = Timer.from_json(blob)
+            self._timers[timer.id] = timer
+
     async def add_timer(self, timer: dict):
-        timer = deepcopy(timer)
-        timer["id"] = 0
-        async with self._auth():
-            ret = await self._json_req("POST", "api/value/timer", json=timer)
+        timer = dict(timer, id=0)
+        async with self._write_lock(["timer"]), self._auth():
+            ret = await self._json_req(
+                "POST", "api/value/timer", json=timer, priority=PRIORITY_INTERACTIVE
+            )
+            self._cache_timer(dict(timer, id=ret["id"]))
             return ret["id"]
 
     async def list_timers(self):
         async with self._auth():
             ret = await self._json_req("GET", "api/value/timer")
+            self._timers = {}
+            for blob in ret:
+                self._cache_timer(blob)
             return ret
 
     async def get_timer(self, idx: int):
@@ -263,13 +794,49 @@ class GeyserwalaClientAsync:
             return ret
 
     async def update_timer(self, timer: dict):
-        async with self._auth():
+        async with self._write_lock(["timer"]), self._auth():
             ret = await self._json_req(
-                "PUT", f"api/value/timer/{timer['id']}", json=timer
+                "PUT", f"api/value/timer/{timer['id']}", json=timer, priority=PRIORITY_INTERACTIVE
             )
+            if ret:
+                self._cache_timer(timer)
             return ret
 
     async def delete_timer(self, idx: int):
-        async with self._auth():
-            ret = await self._json_req("DELETE", f"api/value/timer/{idx}")
-            return ret["success"] is True and ret["id"] == idx
+        async with self._write_lock(["timer"]), self._auth():
+            ret = await self._json_req(
+                "DELETE", f"api/value/timer/{idx}", priority=PRIORITY_INTERACTIVE
+            )
+            ok = ret["success"] is True and ret["id"] == idx
+            if ok and self._timers is not None:
+                self._timers.pop(idx, None)
+            return ok
+
+    @property
+    def timers(self):
+        # Cached timer table, None until listed
+        if self._timers is None:
+            return None
+        return list(self._timers.values())
+
+    async def sync_timers(self, desired, refresh=False):
+        desired = [t if isinstance(t, Timer) else Timer.from_json(t) for t in desired]
+        if self._timers is None or refresh:
+            await self.list_timers()
+        ops = diff_timers(self._timers.values(), desired)
+        for op in ops:
+            try:
+                if op.action == TIMER_OP_UPDATE:
+                    op.ok = bool(await self.update_timer(op.timer.to_json()))
+                elif op.action == TIMER_OP_DELETE:
+                    op.ok = await self.delete_timer(op.timer.id)
+                else:
+                    idx = await self.add_timer(op.timer.to_json())
+                    op.timer = op.timer.with_id(idx)
+                    op.ok = True
+            except (GeyserwalaException, KeyError, TypeError) as ex:
+                op.error = ex
+            if not op.ok:
+                # The device table is now unknown, re-list on the next sync
+                self._timers = None
+        return ops
@@ -2,13 +2,21 @@
 # Copyright (c) 2023 Thingwala                                                     #
 ####################################################################################
 import asyncio
+import json
+import os
+import time
 
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 import logging
 
+import aiohttp
+
 from zeroconf import IPVersion
 from zeroconf.asyncio import AsyncServiceBrowser, AsyncZeroconf
 
+from thingwala.geyserwala.aio.client import GeyserwalaClientAsync
+from thingwala.geyserwala.errors import GeyserwalaException, Unauthorized
+
 logger = logging.getLogger(__name__)
 
 
@@ -19,41 +27,215 @@ class Device:
     hostname: str
     properties: dict[str, str]
 
+    @property
+    def id(self):
+        return self.properties.get("id")
+
+    @classmethod
+    def from_service_info(cls, info):
+        properties = {
+            k.decode("utf-8"): v.decode("utf-8")
+            for k, v in info.properties.items()
+        }
+        return cls(info.parsed_addresses()[0], info.port, info.server, properties)
+
+
+class GeyserwalaDiscoveryCache:
+    """Discovered devices persisted between runs, keyed by device id."""
+
+    def __init__(self, path) -> None:
+        self._path = path
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self._path, "rt", encoding="utf8") as f:
+                    self._entries = json.load(f)["devices"]
+            except FileNotFoundError:
+                self._entries = {}
+            except (ValueError, KeyError, TypeError) as ex:
+                logger.warning("Ignoring unreadable discovery cache %s: %s", self._path, ex)
+                self._entries = {}
+        return self._entries
+
+    def devices(self) -> list[Device]:
+        return [
+            Device(e["ip"], e["port"], e["hostname"], e["properties"])
+            for e in self._load().values()
+        ]
+
+    def last_seen(self, device_id):
+        entry = self._load().get(device_id)
+        return entry and entry["last_seen"]
+
+    def misses(self, device_id):
+        entry = self._load().get(device_id)
+        return entry.get("misses", 0) if entry else 0
+
+    def put(self, device: Device, last_seen=None):
+        if device.id is None:
+            return
+        self._load()[device.id] = dict(asdict(device), last_seen=last_seen or time.time(), misses=0)
+
+    def miss(self, device_id):
+        # Counts discoveries in a row the device was not found in
+        entry = self._load().get(device_id)
+        if entry is None:
+            return 0
+        entry["misses"] = entry.get("misses", 0) + 1
+        return entry["misses"]
+
+    def remove(self, device_id):
+        self._load().pop(device_id, None)
+
+    def expire(self, max_age, max_misses=None, now=None):
+        # Drops entries not seen for max_age seconds or missed max_misses
+        # times in a row, returns their ids
+        now = time.time() if now is None else now
+
+        def _expired(entry):
+            if now - entry["last_seen"] > max_age:
+                return True
+            return max_misses is not None and entry.get("misses", 0) >= max_misses
+
+        expired = [device_id for device_id, entry in self._load().items() if _expired(entry)]
+        for device_id in expired:
+            self.remove(device_id)
+        return expired
+
+    def flush(self):
+        tmp = f"{self._path}.tmp"
+        with open(tmp, "wt", encoding="utf8") as f:
+            json.dump({"devices": self._load()}, f)
+        os.replace(tmp, self._path)
+
 
 class GeyserwalaDiscoveryAsync:
-    async def mdns_discover(self, timeout=10) -> None:
-        devices = []
-        services = "_geyserwala._tcp.local."
-        aio_zc = AsyncZeroconf(ip_version=IPVersion.V4Only)
-        try:
-            found = []
+    services = "_geyserwala._tcp.local."
 
-            def _handler(_zeroconf, service_type, name, state_change):
-                if state_change.name == "Added":
-                    found.append((service_type, name))
+    async def mdns_discover(self, timeout=10) -> list[Device]:
+        return [device async for device in self.mdns_stream(timeout)]
 
-            aio_browser = AsyncServiceBrowser(
-                aio_zc.zeroconf,
-                services,
-                handlers=[_handler],
+    async def identify(self, device: Device, session, username=None, password=None, timeout=1):
+        # Id of the unit answering at the device's address, None if there is
+        # none or it cannot be logged in to
+        client = GeyserwalaClientAsync(
+            device.ip,
+            username,
+            password,
+            port=device.port,
+            session=session,
+            connect_timeout=timeout,
+            retries=0,
+        )
+        try:
+            if await asyncio.wait_for(client.update(), timeout):
+                return client.get_value("id")
+        except Unauthorized:
+            # Reachable, but the credentials are wrong so it can't be confirmed
+            logger.warning(
+                "Login to cached device %s at %s:%s failed, check the credentials",
+                device.id, device.ip, device.port,
             )
+        except (GeyserwalaException, asyncio.TimeoutError) as ex:
+            logger.debug("Unable to identify %s:%s: %r", device.ip, device.port, ex)
+        finally:
+            await client.close()
+        return None
 
-            await asyncio.sleep(timeout)
-            await aio_browser.async_cancel()
+    async def cached_discover(
+        self,
+        cache: GeyserwalaDiscoveryCache,
+        timeout=10,
+        probe_timeout=1,
+        username=None,
+        password=None,
+        max_age=7 * 24 * 3600,
+        max_misses=3,
+    ) -> list[Device]:
+        # Cached devices still answering with their own id are used as is,
+        # mDNS only runs to find the ones that do not. Entries not seen for
+        # max_age seconds, or missed max_misses runs in a row, are dropped
+        # first. Without a cache entry it is a full scan.
+        expired = cache.expire(max_age, max_misses)
+        if expired:
+            logger.debug("Expired cached devices: %s", expired)
+        cached = cache.devices()
+        async with aiohttp.ClientSession() as session:
+            ids = await asyncio.gather(*[
+                self.identify(d, session, username, password, probe_timeout) for d in cached
+            ])
+        devices = {d.id: d for d, found in zip(cached, ids) if found == d.id}
+        missing = [d.id for d in cached if d.id not in devices]
+        if missing or not cached:
+            async for device in self.mdns_stream(timeout, ids=missing or None):
+                devices[device.id] = device
+        now = time.time()
+        for device in devices.values():
+            cache.put(device, now)
+        for device_id in missing:
+            if device_id not in devices:
+                cache.miss(device_id)
+        cache.flush()
+        return list(devices.values())
 
-            for service_type, name in found:
-                info = await aio_zc.async_get_service_info(service_type, name)
-                properties = {
-                    k.decode("utf-8"): v.decode("utf-8")
-                    for k, v in info.properties.items()
-                }
-                devices.append(
-                    Device(
-                        info.parsed_addresses()[0], info.port, info.server, properties
-                    )
-                )
+    async def mdns_stream(self, timeout=10, expected=None, ids=None):
+        # Yields devices as they resolve. Ends after timeout, or early once
+        # expected devices or all of the given ids have been seen.
+        loop = asyncio.get_running_loop()
+        ids = set(ids) if ids else None
+        found = asyncio.Queue()
+        seen = set()
+        pending = set()
+        aio_zc = AsyncZeroconf(ip_version=IPVersion.V4Only)
+
+        async def _resolve(service_type, name):
+            info = await aio_zc.async_get_service_info(service_type, name)
+            if info is None:
+                logger.debug("Unable to resolve %s", name)
+                return
+            found.put_nowait(Device.from_service_info(info))
+
+        def _added(service_type, name):
+            if name in seen:
+                return
+            seen.add(name)
+            task = asyncio.ensure_future(_resolve(service_type, name))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        def _handler(_zeroconf, service_type, name, state_change):
+            if state_change.name == "Added":
+                loop.call_soon_threadsafe(_added, service_type, name)
 
+        aio_browser = AsyncServiceBrowser(
+            aio_zc.zeroconf,
+            self.services,
+            handlers=[_handler],
+        )
+        try:
+            deadline = loop.time() + timeout
+            count = 0
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    device = await asyncio.wait_for(found.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                count += 1
+                if ids is not None:
+                    ids.discard(device.id)
+                yield device
+                if expected is not None and count >= expected:
+                    break
+                if ids is not None and not ids:
+                    break
         finally:
+            await aio_browser.async_cancel()
+            for task in list(pending):
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
             await aio_zc.async_close()
-
-        return devices
@@ -0,0 +1,188 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import asyncio
+import logging
+import random
+
+from dataclasses import dataclass
+from typing import Optional
+
+from thingwala.geyserwala.aio.client import GeyserwalaClientAsync
+from thingwala.geyserwala.aio.pool import GeyserwalaConnectionPool
+from thingwala.geyserwala.aio.scheduler import PRIORITY_BACKGROUND
+from thingwala.geyserwala.errors import GeyserwalaException
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FleetResult:
+    client: GeyserwalaClientAsync
+    ok: bool
+    error: Optional[Exception] = None
+
+
+class GeyserwalaFleetAsync:
+    def __init__(
+        self,
+        session=None,
+        max_concurrency=32,
+        timeout=None,
+        metrics=False,
+        pool=None,
+        rate_limit=None,
+    ) -> None:
+        self._own_pool = session is None and pool is None
+        self._pool = None
+        if session is None:
+            self._pool = pool or GeyserwalaConnectionPool(limit=max_concurrency * 2)
+        self._session = session
+        self._max_concurrency = max_concurrency
+        self._timeout = timeout
+        self._clients = {}
+        self._capabilities = {}
+        self._metrics = metrics
+        self._rate_limit = rate_limit
+        # (semaphore, interval, poll task per key, result) while run() is active
+        self._runner = None
+
+    async def close(self):
+        if self._own_pool:
+            await self._pool.close()
+
+    @property
+    def session(self):
+        # Taken from the pool when first needed, so the fleet can be built
+        # outside a running loop and follows a pool session that was recreated
+        if self._session is None:
+            return self._pool.session
+        return self._session
+
+    @property
+    def clients(self):
+        return dict(self._clients)
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __contains__(self, key):
+        return key in self._clients
+
+    def get(self, key):
+        return self._clients.get(key)
+
+    @property
+    def capabilities(self):
+        return self._capabilities
+
+    def add(self, host, username=None, password=None, port=80, key=None, device_id=None):
+        key = key or f"{host}:{port}"
+        if key in self._clients:
+            raise KeyError(f"Device already in fleet: {key}")
+        client = GeyserwalaClientAsync(
+            host,
+            username,
+            password,
+            port=port,
+            session=self.session,
+            device_id=device_id,
+            capabilities=self._capabilities,
+            metrics=self._metrics,
+            rate_limit=self._rate_limit,
+        )
+        self._clients[key] = client
+        if self._runner is not None:
+            self._start_polling(key, client)
+        return client
+
+    def stats(self):
+        return {key: client.stats() for key, client in self._clients.items()}
+
+    def health(self):
+        return {key: client.health.to_dict() for key, client in self._clients.items()}
+
+    def remove(self, key):
+        # Stops polling the device, see retire() to also close its client
+        client = self._clients.pop(key)
+        if self._runner is not None:
+            task = self._runner[2].pop(key, None)
+            if task is not None:
+                task.cancel()
+        return client
+
+    async def retire(self, key):
+        client = self.remove(key)
+        await client.close()
+        return client
+
+    async def _call(self, sem, client, coro_fn):
+        async with sem:
+            try:
+                if self._timeout is None:
+                    ok = await coro_fn(client)
+                else:
+                    ok = await asyncio.wait_for(coro_fn(client), self._timeout)
+                return FleetResult(client, bool(ok))
+            except asyncio.TimeoutError as ex:
+                return FleetResult(client, False, ex)
+            except GeyserwalaException as ex:
+                return FleetResult(client, False, ex)
+
+    async def gather(self, coro_fn, keys=None):
+        keys = list(self._clients) if keys is None else list(keys)
+        sem = asyncio.Semaphore(self._max_concurrency)
+        results = await asyncio.gather(
+            *[self._call(sem, self._clients[k], coro_fn) for k in keys]
+        )
+        return dict(zip(keys, results))
+
+    async def update(self, keys=None):
+        results = await self.gather(lambda client: client.update(PRIORITY_BACKGROUND), keys)
+        failed = [k for k, r in results.items() if not r.ok]
+        if failed:
+            logger.debug("Fleet update failed for %d/%d devices: %s", len(failed), len(results), failed)
+        return results
+
+    async def _run_client(self, sem, key, client, interval):
+        next_interval = interval(client) if callable(interval) else (lambda: interval)
+        # Spread the first polls so the fleet does not run in lockstep
+        await asyncio.sleep(random.uniform(0, next_interval()))
+        while True:
+            result = await self._call(
+                sem, client, lambda c: c.update(PRIORITY_BACKGROUND)
+            )
+            if not result.ok:
+                logger.debug("Fleet poll failed for %s: %r", key, result.error)
+            await asyncio.sleep(next_interval())
+
+    def _start_polling(self, key, client):
+        sem, interval, tasks, result = self._runner
+        task = asyncio.ensure_future(self._run_client(sem, key, client, interval))
+        tasks[key] = task
+
+        def _done(t):
+            if not t.cancelled() and t.exception() is not None and not result.done():
+                result.set_exception(t.exception())
+
+        task.add_done_callback(_done)
+
+    async def run(self, interval=2):
+        # Poll every device until cancelled, including devices added or
+        # removed while running. interval is in seconds, or a callable taking
+        # a client and returning its interval callable, e.g.
+        # lambda client: AdaptivePollInterval().attach(client)
+        if self._runner is not None:
+            raise RuntimeError("Fleet is already running")
+        result = asyncio.get_running_loop().create_future()
+        tasks = {}
+        self._runner = (asyncio.Semaphore(self._max_concurrency), interval, tasks, result)
+        try:
+            for key, client in self._clients.items():
+                self._start_polling(key, client)
+            await result
+        finally:
+            self._runner = None
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
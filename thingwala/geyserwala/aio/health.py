@@ -0,0 +1,125 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import random
+import time
+
+HEALTH_CLOSED = "closed"
+HEALTH_OPEN = "open"
+HEALTH_HALF_OPEN = "half-open"
+
+
+class DeviceHealth:
+    """Circuit breaker and retry budget for one device.
+
+    After `threshold` consecutive transport failures the circuit opens and
+    requests fail fast. Once the backoff has passed a single probe request is
+    let through, success closes the circuit, failure doubles the backoff up
+    to `max_backoff`. Failures of requests that were already in flight when
+    the circuit opened are counted but do not extend the backoff. Each request earns `retry_ratio` of a retry, so retries
+    stay a bounded share of the traffic to a device."""
+
+    def __init__(
+        self,
+        threshold=3,
+        backoff=1,
+        max_backoff=300,
+        retry_ratio=0.2,
+        min_retries=3,
+        jitter=0.1,
+    ) -> None:
+        self._threshold = threshold
+        self._base_backoff = backoff
+        self._max_backoff = max_backoff
+        self._retry_ratio = retry_ratio
+        self._max_retry_tokens = max(min_retries, 1)
+        self._retry_tokens = float(min_retries)
+        self._jitter = jitter
+        self._state = HEALTH_CLOSED
+        self._failures = 0
+        self._backoff = backoff
+        self._opened = 0
+        self._retry_at = 0
+        self._probe = None
+        self.last_error = None
+
+    @property
+    def state(self):
+        if self._state == HEALTH_OPEN and self._probe is None and self._now() >= self._retry_at:
+            return HEALTH_HALF_OPEN
+        return self._state
+
+    @property
+    def healthy(self):
+        return self._state == HEALTH_CLOSED
+
+    @property
+    def failures(self):
+        return self._failures
+
+    @property
+    def retry_after(self):
+        # Seconds until the next probe is let through, 0 when closed
+        if self._state == HEALTH_CLOSED:
+            return 0
+        return max(0, self._retry_at - self._now())
+
+    def allow(self):
+        # A ticket if a request may go out now, None if not. Claims the probe
+        # when half open, pass the ticket back with the request's outcome.
+        if self._state == HEALTH_CLOSED:
+            self._retry_tokens = min(
+                self._max_retry_tokens, self._retry_tokens + self._retry_ratio
+            )
+            return True
+        if self._probe is not None or self._now() < self._retry_at:
+            return None
+        self._probe = object()
+        return self._probe
+
+    def can_retry(self):
+        if self._state != HEALTH_CLOSED or self._retry_tokens < 1:
+            return False
+        self._retry_tokens -= 1
+        return True
+
+    def release(self, ticket=None):
+        # A request let through that ended without an outcome, e.g. cancelled
+        if ticket is not None and ticket is self._probe:
+            self._probe = None
+
+    def record_success(self):
+        # Any answer from the device closes the circuit, probe or not
+        self._state = HEALTH_CLOSED
+        self._failures = 0
+        self._backoff = self._base_backoff
+        self._probe = None
+        self.last_error = None
+
+    def record_failure(self, error=None, ticket=None):
+        self._failures += 1
+        self.last_error = error
+        if self._state == HEALTH_CLOSED:
+            if self._failures >= self._threshold:
+                self._open(self._backoff)
+        elif ticket is not None and ticket is self._probe:
+            # Failed probe, wait longer before the next one
+            self._backoff = min(self._max_backoff, self._backoff * 2)
+            self._open(self._backoff)
+
+    def _open(self, backoff):
+        self._state = HEALTH_OPEN
+        self._probe = None
+        self._opened = self._now()
+        self._retry_at = self._opened + backoff * random.uniform(1, 1 + self._jitter)
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "failures": self._failures,
+            "retry_after": self.retry_after,
+            "last_error": None if self.last_error is None else self.last_error.__class__.__name__,
+        }
+
+    def _now(self):
+        return time.monotonic()
@@ -0,0 +1,97 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import re
+
+from bisect import bisect_left
+from collections import Counter
+
+# Upper bounds in seconds, the last bucket catches the rest
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint(path):
+    # api/value/timer/3 -> api/value/timer/{idx}, so timer calls share a series
+    return _ID_SEGMENT.sub("/{idx}", path)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q quantile
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for n, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[n] if n < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip([*self.buckets, "inf"], self.counts)),
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+class ClientMetrics:
+    """Request counters and latency histograms for one client."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS) -> None:
+        self._buckets = buckets
+        self.requests = Counter()
+        self.status = Counter()
+        self.errors = Counter()
+        self.latency = {}
+        self.bytes_received = 0
+        self.cache = Counter()
+
+    def _histogram(self, key):
+        histogram = self.latency.get(key)
+        if histogram is None:
+            histogram = self.latency[key] = Histogram(self._buckets)
+        return histogram
+
+    def record_request(self, method, path, seconds, error=None):
+        key = f"{method} {endpoint(path)}"
+        self.requests[key] += 1
+        self._histogram(key).observe(seconds)
+        if error is not None:
+            self.errors[(key, error.__class__.__name__)] += 1
+
+    def record_response(self, status, nbytes):
+        self.status[status] += 1
+        self.bytes_received += nbytes or 0
+
+    def record_cache(self, outcome):
+        # "hit", "miss" or "coalesced"
+        self.cache[outcome] += 1
+
+    def snapshot(self):
+        return {
+            "requests": dict(self.requests),
+            "status": dict(self.status),
+            "errors": {f"{key} {name}": n for (key, name), n in self.errors.items()},
+            "latency": {key: h.to_dict() for key, h in self.latency.items()},
+            "bytes_received": self.bytes_received,
+            "cache": dict(self.cache),
+        }
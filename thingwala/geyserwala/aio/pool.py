@@ -0,0 +1,57 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import aiohttp
+
+from thingwala.geyserwala.aio.client import GeyserwalaClientAsync
+
+
+class GeyserwalaConnectionPool:
+    """One tuned aiohttp session shared by many clients. Auth state lives on
+    each client, so any number of devices can share the pool."""
+
+    def __init__(
+        self,
+        limit=256,
+        limit_per_host=2,
+        keepalive_timeout=30,
+        ttl_dns_cache=300,
+        trace_configs=None,
+    ) -> None:
+        self._connector_args = {
+            "limit": limit,
+            "limit_per_host": limit_per_host,
+            "keepalive_timeout": keepalive_timeout,
+            "ttl_dns_cache": ttl_dns_cache,
+            "use_dns_cache": ttl_dns_cache is not None,
+        }
+        self._limit_per_host = limit_per_host
+        self._trace_configs = trace_configs
+        self._session = None
+
+    @property
+    def session(self):
+        # Created on first use so the pool can be built outside a running loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(**self._connector_args),
+                trace_configs=self._trace_configs,
+            )
+        return self._session
+
+    def client(self, host, username=None, password=None, port=80, **kwargs):
+        kwargs.setdefault("max_connections", self._limit_per_host or 2)
+        return GeyserwalaClientAsync(
+            host, username, password, port=port, session=self.session, **kwargs
+        )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,141 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import asyncio
+import logging
+
+from zeroconf import IPVersion
+from zeroconf.asyncio import AsyncServiceBrowser, AsyncZeroconf
+
+from thingwala.geyserwala.aio.discovery import Device, GeyserwalaDiscoveryAsync
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_ADDED = "added"
+REGISTRY_UPDATED = "updated"
+REGISTRY_REMOVED = "removed"
+
+
+class GeyserwalaRegistryAsync:
+    """Live map of device id to Device, kept current by a long running mDNS
+    browser. Given a fleet, it also adds, repoints and retires its clients."""
+
+    def __init__(self, fleet=None, username=None, password=None) -> None:
+        self._fleet = fleet
+        self._user = username
+        self._pass = password
+        self._devices = {}
+        self._names = {}
+        self._listeners = []
+        self._tasks = set()
+        self._aio_zc = None
+        self._aio_browser = None
+
+    @property
+    def devices(self):
+        return dict(self._devices)
+
+    def get(self, device_id):
+        return self._devices.get(device_id)
+
+    def add_listener(self, callback):
+        # callback(event, device) on REGISTRY_ADDED, _UPDATED and _REMOVED
+        self._listeners.append(callback)
+
+        def _remove():
+            self._listeners.remove(callback)
+
+        return _remove
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def start(self):
+        if self._aio_zc is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._aio_zc = AsyncZeroconf(ip_version=IPVersion.V4Only)
+
+        def _handler(_zeroconf, service_type, name, state_change):
+            loop.call_soon_threadsafe(self._on_change, service_type, name, state_change.name)
+
+        self._aio_browser = AsyncServiceBrowser(
+            self._aio_zc.zeroconf,
+            GeyserwalaDiscoveryAsync.services,
+            handlers=[_handler],
+        )
+
+    async def stop(self):
+        if self._aio_zc is None:
+            return
+        await self._aio_browser.async_cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._aio_zc.async_close()
+        self._aio_zc = None
+        self._aio_browser = None
+
+    def _on_change(self, service_type, name, state):
+        if state in ("Added", "Updated"):
+            task = asyncio.ensure_future(self._resolve(service_type, name))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif state == "Removed":
+            device_id = self._names.pop(name, None)
+            device = self._devices.pop(device_id, None)
+            if device is not None:
+                self._retire(device)
+                self._notify(REGISTRY_REMOVED, device)
+
+    async def _resolve(self, service_type, name):
+        info = await self._aio_zc.async_get_service_info(service_type, name)
+        if info is None:
+            logger.debug("Unable to resolve %s", name)
+            return
+        device = Device.from_service_info(info)
+        if device.id is None:
+            logger.warning("Ignoring %s without an id", name)
+            return
+        self._names[name] = device.id
+        old = self._devices.get(device.id)
+        if old == device:
+            return
+        self._devices[device.id] = device
+        self._track(device)
+        self._notify(REGISTRY_ADDED if old is None else REGISTRY_UPDATED, device)
+
+    def _track(self, device):
+        if self._fleet is None:
+            return
+        client = self._fleet.get(device.id)
+        if client is None:
+            self._fleet.add(
+                device.ip,
+                self._user,
+                self._pass,
+                port=device.port,
+                key=device.id,
+                device_id=device.id,
+            )
+        else:
+            client.set_address(device.ip, device.port)
+
+    def _retire(self, device):
+        if self._fleet is not None and device.id in self._fleet:
+            # Out of the fleet at once, closing the client can finish later
+            client = self._fleet.remove(device.id)
+            task = asyncio.ensure_future(client.close())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _notify(self, event, device):
+        for callback in list(self._listeners):
+            try:
+                callback(event, device)
+            except Exception:
+                logger.exception("Registry listener failed on %s", device.id)
@@ -0,0 +1,95 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import asyncio
+import heapq
+import itertools
+import time
+
+from contextlib import asynccontextmanager
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_READ = 1
+PRIORITY_BACKGROUND = 2
+
+
+class RequestScheduler:
+    """Runs at most max_concurrency requests to a device at a time, highest
+    priority first and FIFO within a priority. With a rate, a token bucket
+    also caps requests to `rate` per second in bursts of up to `burst`."""
+
+    def __init__(self, max_concurrency=2, rate=None, burst=None) -> None:
+        self._limit = max_concurrency
+        self._active = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._rate = rate
+        self._burst = burst if burst is not None else max(1, rate or 0)
+        self._tokens = self._burst
+        self._stamp = time.monotonic()
+        self._wakeup = None
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def pending(self):
+        return sum(1 for _, _, fut in self._queue if not fut.done())
+
+    @asynccontextmanager
+    async def slot(self, priority=PRIORITY_READ):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority=PRIORITY_READ):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), fut))
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Granted as the waiter was cancelled, pass the slot on
+                self.release()
+            else:
+                fut.cancel()
+            raise
+
+    def release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _take(self):
+        if self._rate is None:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._stamp) * self._rate)
+        self._stamp = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _dispatch(self):
+        while self._queue and self._active < self._limit:
+            fut = self._queue[0][2]
+            if fut.done():
+                heapq.heappop(self._queue)
+                continue
+            if not self._take():
+                if self._wakeup is None:
+                    delay = (1 - self._tokens) / self._rate
+                    self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+                return
+            heapq.heappop(self._queue)
+            self._active += 1
+            fut.set_result(None)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
@@ -0,0 +1,169 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import collections
+import logging
+import time
+
+from dataclasses import dataclass
+from typing import Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RequestSpan:
+    """Timings of one request in seconds. Phases are None when they did not
+    happen, e.g. no dns or connect on a reused connection. queue is the wait
+    for a slot in the client's scheduler, it is not part of total."""
+
+    device: str
+    method: str
+    path: str
+    start: float
+    queue: Optional[float] = None
+    dns: Optional[float] = None
+    connect: Optional[float] = None
+    wait: Optional[float] = None
+    body: Optional[float] = None
+    total: Optional[float] = None
+    reused: bool = False
+    status: Optional[int] = None
+    error: Optional[str] = None
+
+
+class _Trace:
+    """A span in the making, passed to aiohttp as the trace_request_ctx.
+    Holds the raw perf_counter marks set by the trace hooks."""
+
+    __slots__ = ("span", "t0", "dns_start", "connect_start", "sent", "headers", "body_end")
+
+    def __init__(self, span):
+        self.span = span
+        self.t0 = time.perf_counter()
+        self.dns_start = 0
+        self.connect_start = 0
+        self.sent = 0
+        self.headers = 0
+        self.body_end = 0
+
+
+class SpanBuffer:
+    """In-memory sink keeping the most recent spans."""
+
+    def __init__(self, maxlen=1000) -> None:
+        self._spans = collections.deque(maxlen=maxlen)
+
+    def __call__(self, span):
+        self._spans.append(span)
+
+    def __len__(self):
+        return len(self._spans)
+
+    def __iter__(self):
+        return iter(list(self._spans))
+
+    def clear(self):
+        self._spans.clear()
+
+
+class GeyserwalaTracer:
+    """Per phase request timings from aiohttp trace hooks, sent to sink(span)."""
+
+    def __init__(self, sink=None) -> None:
+        self.sink = SpanBuffer() if sink is None else sink
+        self._trace_config = aiohttp.TraceConfig()
+        self._trace_config.on_dns_resolvehost_start.append(self._on_dns_start)
+        self._trace_config.on_dns_resolvehost_end.append(self._on_dns_end)
+        self._trace_config.on_connection_create_start.append(self._on_connect_start)
+        self._trace_config.on_connection_create_end.append(self._on_connect_end)
+        self._trace_config.on_connection_reuseconn.append(self._on_reuse)
+        self._trace_config.on_request_headers_sent.append(self._on_sent)
+        self._trace_config.on_request_end.append(self._on_headers)
+        self._trace_config.on_response_chunk_received.append(self._on_chunk)
+        self._trace_config.on_request_exception.append(self._on_exception)
+
+    @property
+    def trace_config(self):
+        # Sessions shared with a traced client must be created with this in
+        # their trace_configs
+        return self._trace_config
+
+    def traces(self, session):
+        return self._trace_config in (getattr(session, "trace_configs", None) or ())
+
+    def start(self, device, method, path):
+        return _Trace(RequestSpan(device, method, path, time.time()))
+
+    def dequeued(self, trace):
+        # The request got its slot, the device side timings start here
+        now = time.perf_counter()
+        trace.span.queue = now - trace.t0
+        trace.t0 = now
+
+    def finish(self, trace):
+        now = time.perf_counter()
+        span = trace.span
+        if trace.headers:
+            if trace.sent:
+                span.wait = trace.headers - trace.sent
+            span.body = (trace.body_end or trace.headers) - trace.headers
+        span.total = now - trace.t0
+        try:
+            self.sink(span)
+        except Exception:
+            logger.exception("Trace sink failed")
+
+    @staticmethod
+    def _trace(ctx):
+        trace = ctx.trace_request_ctx
+        return trace if isinstance(trace, _Trace) else None
+
+    async def _on_dns_start(self, _session, ctx, _params):
+        trace = self._trace(ctx)
+        if trace is not None:
+            trace.dns_start = time.perf_counter()
+
+    async def _on_dns_end(self, _session, ctx, _params):
+        trace = self._trace(ctx)
+        if trace is not None and trace.dns_start:
+            trace.span.dns = time.perf_counter() - trace.dns_start
+
+    async def _on_connect_start(self, _session, ctx, _params):
+        trace = self._trace(ctx)
+        if trace is not None:
+            trace.connect_start = time.perf_counter()
+
+    async def _on_connect_end(self, _session, ctx, _params):
+        trace = self._trace(ctx)
+        if trace is not None and trace.connect_start:
+            span = trace.span
+            span.connect = time.perf_counter() - trace.connect_start - (span.dns or 0)
+
+    async def _on_reuse(self, _session, ctx, _params):
+        trace = self._trace(ctx)
+        if trace is not None:
+            trace.span.reused = True
+
+    async def _on_sent(self, _session, ctx, _params):
+        trace = self._trace(ctx)
+        if trace is not None:
+            trace.sent = time.perf_counter()
+
+    async def _on_headers(self, _session, ctx, params):
+        trace = self._trace(ctx)
+        if trace is not None:
+            trace.headers = time.perf_counter()
+            trace.span.status = params.response.status
+
+    async def _on_chunk(self, _session, ctx, _params):
+        trace = self._trace(ctx)
+        if trace is not None:
+            trace.body_end = time.perf_counter()
+
+    async def _on_exception(self, _session, ctx, params):
+        trace = self._trace(ctx)
+        if trace is not None:
+            trace.span.error = params.exception.__class__.__name__
@@ -17,3 +17,9 @@ GEYSERWALA_MODES = [
 
 GEYSERWALA_SETPOINT_TEMP_MAX = 75
 GEYSERWALA_SETPOINT_TEMP_MIN = 30
+
+# Keys only present on units with one of the listed features
+GEYSERWALA_FEATURE_KEYS = {
+    "collector-temp": ["f-collector"],
+    "pump-status": ["f-collector"],
+}
@@ -13,5 +13,13 @@ class RequestError(GeyserwalaException):
     """Unable to fulfill request."""
 
 
+class CircuitOpen(RequestError):
+    """Device marked unreachable, request not sent."""
+
+
 class ResponseError(GeyserwalaException):
     """Invalid response."""
+
+
+class TelemetryError(GeyserwalaException):
+    """Malformed telemetry file."""
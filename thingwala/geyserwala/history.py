@@ -0,0 +1,174 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import time
+
+from array import array
+
+GEYSERWALA_HISTORY_KEYS = [
+    "tank-temp",
+    "collector-temp",
+    "setpoint",
+    "pump-status",
+    "element-demand",
+]
+
+# (bucket seconds, buckets kept): 1 day of minutes, 1 week of quarter hours
+GEYSERWALA_HISTORY_TIERS = [
+    (60, 1440),
+    (900, 672),
+]
+
+
+class _Ring:
+    """Fixed capacity columnar ring buffer. The first column holds whole
+    seconds (uint32) and must be non-decreasing, the rest hold float32."""
+
+    def __init__(self, capacity, columns):
+        self._cap = capacity
+        self._cols = [array("I", [0]) * capacity]
+        self._cols.extend(array("f", [0]) * capacity for _ in range(columns - 1))
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, *row):
+        for col, value in zip(self._cols, row):
+            col[self._head] = value
+        self._head = (self._head + 1) % self._cap
+        self._size = min(self._size + 1, self._cap)
+
+    def _index(self, i):
+        return (self._head - self._size + i) % self._cap
+
+    def _bisect(self, t):
+        times = self._cols[0]
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if times[self._index(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start, end):
+        # Columns for rows with start <= time < end
+        i = self._bisect(start)
+        n = self._bisect(end) - i
+        p = self._index(i)
+        if n <= 0:
+            return tuple(col[:0] for col in self._cols)
+        if p + n <= self._cap:
+            return tuple(col[p:p + n] for col in self._cols)
+        return tuple(col[p:] + col[:p + n - self._cap] for col in self._cols)
+
+
+class _Tier:
+    def __init__(self, period, capacity):
+        self.period = period
+        self._ring = _Ring(capacity, 4)
+        self._bucket = None
+        self._min = self._max = self._sum = 0.0
+        self._count = 0
+
+    def add(self, t, value):
+        bucket = t - t % self.period
+        if bucket != self._bucket:
+            self._commit()
+            self._bucket = bucket
+            self._min = self._max = value
+            self._sum = 0.0
+            self._count = 0
+        self._min = min(self._min, value)
+        self._max = max(self._max, value)
+        self._sum += value
+        self._count += 1
+
+    def _commit(self):
+        if self._count:
+            self._ring.append(self._bucket, self._min, self._max, self._sum / self._count)
+            self._count = 0
+
+    def range(self, start, end):
+        # (time, min, max, mean) columns, including the bucket still filling
+        cols = self._ring.range(start, end)
+        if self._count and start <= self._bucket < end:
+            row = (self._bucket, self._min, self._max, self._sum / self._count)
+            for col, value in zip(cols, row):
+                col.append(value)
+        return cols
+
+
+class SeriesHistory:
+    def __init__(self, raw_capacity=1800, tiers=None):
+        self._raw = _Ring(raw_capacity, 2)
+        self._tiers = [
+            _Tier(period, capacity)
+            for period, capacity in (GEYSERWALA_HISTORY_TIERS if tiers is None else tiers)
+        ]
+
+    def __len__(self):
+        return len(self._raw)
+
+    @property
+    def resolutions(self):
+        return [tier.period for tier in self._tiers]
+
+    def add(self, t, value):
+        t = int(t)
+        value = float(value)
+        self._raw.append(t, value)
+        for tier in self._tiers:
+            tier.add(t, value)
+
+    def range(self, start, end, resolution=None):
+        # Raw (time, value) columns, or (time, min, max, mean) for the tier
+        # with the given bucket seconds
+        if resolution is None:
+            return self._raw.range(start, end)
+        for tier in self._tiers:
+            if tier.period == resolution:
+                return tier.range(start, end)
+        raise ValueError(f"No history tier with resolution {resolution}")
+
+
+class GeyserwalaHistory:
+    """Per device telemetry history with fixed memory per key."""
+
+    def __init__(self, keys=None, raw_capacity=1800, tiers=None) -> None:
+        keys = GEYSERWALA_HISTORY_KEYS if keys is None else keys
+        self._series = {key: SeriesHistory(raw_capacity, tiers) for key in keys}
+
+    @property
+    def keys(self):
+        return list(self._series)
+
+    def series(self, key):
+        return self._series[key]
+
+    def record(self, values, t=None):
+        t = time.time() if t is None else t
+        for key, series in self._series.items():
+            value = values.get(key)
+            if isinstance(value, (bool, int, float)):
+                series.add(t, value)
+
+    def range(self, key, start, end, resolution=None):
+        return self._series[key].range(start, end, resolution)
+
+    def attach(self, client):
+        for key in self._series:
+            client.subscribe(key)
+        return client.add_update_listener(lambda c: self.record(c.state, c.last_update))
+
+
+def attach_fleet(fleet, **kwargs):
+    # One history per device currently in the fleet, by fleet key
+    histories = {}
+    for key, client in fleet.clients.items():
+        histories[key] = GeyserwalaHistory(**kwargs)
+        histories[key].attach(client)
+    return histories
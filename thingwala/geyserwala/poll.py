@@ -0,0 +1,61 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import random
+
+GEYSERWALA_ACTIVITY_KEYS = [
+    "element-demand",
+    "pump-status",
+    "tank-temp",
+]
+
+
+class AdaptivePollInterval:
+    """Poll interval that drops to min_interval while activity keys change
+    and backs off towards max_interval while they are stable."""
+
+    def __init__(
+        self,
+        min_interval=2,
+        max_interval=60,
+        keys=None,
+        backoff=1.5,
+        jitter=0.1,
+    ) -> None:
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError("Require 0 < min_interval <= max_interval")
+        self._min = min_interval
+        self._max = max_interval
+        self._keys = set(GEYSERWALA_ACTIVITY_KEYS if keys is None else keys)
+        self._backoff = backoff
+        self._jitter = jitter
+        self._interval = min_interval
+        self._changed = False
+
+    @property
+    def interval(self):
+        return self._interval
+
+    def attach(self, client):
+        # Activity keys outside the base keys, e.g. pump-status, need polling
+        for key in self._keys:
+            client.subscribe(key)
+        client.add_listener(self._on_change)
+        return self
+
+    def _on_change(self, key, old, _new):
+        if key in self._keys and old is not None:
+            self._changed = True
+
+    def observe(self, changed):
+        if changed:
+            self._interval = self._min
+        else:
+            self._interval = min(self._interval * self._backoff, self._max)
+
+    def __call__(self):
+        # Advance once per poll, returning the seconds until the next one
+        self.observe(self._changed)
+        self._changed = False
+        spread = self._interval * self._jitter
+        return max(self._min, min(self._max, self._interval + random.uniform(-spread, spread)))
@@ -0,0 +1,132 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+from typing import NamedTuple, Optional, Tuple
+
+# Device key -> state field, for the keys with a typed field
+GEYSERWALA_STATE_FIELDS = {
+    "id": "id",
+    "name": "name",
+    "version": "version",
+    "features": "features",
+    "status": "status",
+    "mode": "mode",
+    "tank-temp": "tank_temp",
+    "element-demand": "element_demand",
+    "setpoint": "setpoint",
+    "collector-temp": "collector_temp",
+    "pump-status": "pump_status",
+    "boost-demand": "boost_demand",
+}
+
+
+class GeyserwalaState(NamedTuple):
+    """Immutable device state. Known keys are typed fields, None until
+    fetched. Any other keys are (key, value) pairs in extra, sorted by key,
+    with lists and dicts frozen. features holds (name, enabled) pairs, sorted
+    by name. get() returns values in the device's format."""
+
+    id: Optional[str] = None
+    name: Optional[str] = None
+    version: Optional[str] = None
+    features: Optional[Tuple[Tuple[str, bool], ...]] = None
+    status: Optional[str] = None
+    mode: Optional[str] = None
+    tank_temp: Optional[int] = None
+    element_demand: Optional[bool] = None
+    setpoint: Optional[int] = None
+    collector_temp: Optional[int] = None
+    pump_status: Optional[bool] = None
+    boost_demand: Optional[bool] = None
+    extra: Tuple[Tuple[str, object], ...] = ()
+
+    @classmethod
+    def from_values(cls, values):
+        return cls().merge(values)
+
+    def merge(self, values):
+        # New state with the device keys in values applied, self if none
+        # of them change it
+        fields = {}
+        extra = None
+        for key, value in values.items():
+            field = GEYSERWALA_STATE_FIELDS.get(key)
+            if field is None:
+                extra = dict(self.extra) if extra is None else extra
+                extra[key] = _freeze(value)
+                continue
+            if key == "features" and value is not None:
+                value = _features(value)
+            if getattr(self, field) != value:
+                fields[field] = value
+        if extra is not None and tuple(sorted(extra.items())) != self.extra:
+            fields["extra"] = tuple(sorted(extra.items()))
+        return self._replace(**fields) if fields else self
+
+    def without(self, key):
+        field = GEYSERWALA_STATE_FIELDS.get(key)
+        if field is not None:
+            return self._replace(**{field: None})
+        extra = tuple((k, v) for k, v in self.extra if k != key)
+        return self._replace(extra=extra) if extra != self.extra else self
+
+    def get(self, key, default=None):
+        # Value of a device key in the device's format
+        field = GEYSERWALA_STATE_FIELDS.get(key)
+        if field is not None:
+            value = getattr(self, field)
+            if value is None:
+                return default
+            if key == "features":
+                return dict(value)
+            return value
+        for k, value in self.extra:
+            if k == key:
+                return _thaw(value)
+        return default
+
+    def has_feature(self, name):
+        for f, on in self.features or ():
+            if f == name:
+                return on
+        return False
+
+    def to_dict(self):
+        values = {}
+        for key in GEYSERWALA_STATE_FIELDS:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        values.update((k, _thaw(v)) for k, v in self.extra)
+        return values
+
+
+# Units share a handful of feature sets, keep one copy of each
+_FEATURE_SETS = {}
+
+
+def _features(value):
+    features = tuple(sorted((k, bool(on)) for k, on in value.items()))
+    return _FEATURE_SETS.setdefault(features, features)
+
+
+class _FrozenDict(tuple):
+    # A dict frozen to sorted (key, value) pairs, told apart from a list
+    __slots__ = ()
+
+
+def _freeze(value):
+    # Keep the snapshot immutable and hashable
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return _FrozenDict(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, _FrozenDict):
+        return {k: _thaw(v) for k, v in value}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
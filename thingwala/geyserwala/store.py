@@ -0,0 +1,119 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 1
+
+
+class GeyserwalaStateStore:
+    """Persisted session token, capabilities and last values per device.
+
+    Changes are batched: on a running loop they are written flush_delay
+    seconds after the first one, off the loop. Call close() (or flush()
+    without a loop) to write what is left before exiting."""
+
+    def __init__(self, path, flush_delay=1) -> None:
+        self._path = path
+        self._devices = None
+        self._flush_delay = flush_delay
+        self._dirty = False
+        self._timer = None
+        self._writing = None
+
+    def _load(self):
+        if self._devices is None:
+            try:
+                with open(self._path, "rt", encoding="utf8") as f:
+                    blob = json.load(f)
+                if blob.get("version") != STORE_VERSION:
+                    raise ValueError(f"Unsupported store version: {blob.get('version')}")
+                self._devices = blob["devices"]
+            except FileNotFoundError:
+                self._devices = {}
+            except (ValueError, KeyError, AttributeError) as ex:
+                logger.warning("Ignoring unreadable state store %s: %s", self._path, ex)
+                self._devices = {}
+        return self._devices
+
+    def get(self, key):
+        return self._load().get(key)
+
+    def put(self, key, **state):
+        devices = self._load()
+        entry = devices.setdefault(key, {})
+        entry.update(state)
+        entry["saved"] = time.time()
+        self._changed()
+
+    def remove(self, key):
+        if self._load().pop(key, None) is not None:
+            self._changed()
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    def _changed(self):
+        self._dirty = True
+        if self._timer is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._timer = loop.call_later(self._flush_delay, self._flush_later)
+
+    def _flush_later(self):
+        self._timer = None
+        task = asyncio.ensure_future(self.aflush())
+        task.add_done_callback(self._flushed)
+
+    def _flushed(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Failed to write state store %s: %s", self._path, task.exception())
+
+    def _dump(self):
+        # Serialized on the caller's thread, so the devices can't change mid-dump
+        self._dirty = False
+        return json.dumps({"version": STORE_VERSION, "devices": self._load()})
+
+    def _write(self, blob):
+        # Holds session tokens, readable by the owner only
+        tmp = f"{self._path}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wt", encoding="utf8") as f:
+            f.write(blob)
+        os.replace(tmp, self._path)
+
+    def flush(self):
+        if self._dirty:
+            self._write(self._dump())
+
+    async def aflush(self):
+        # Writes pending changes in an executor, one write at a time
+        while self._writing is not None:
+            await asyncio.shield(self._writing)
+        if not self._dirty:
+            return
+        blob = self._dump()
+        self._writing = asyncio.get_running_loop().run_in_executor(None, self._write, blob)
+        try:
+            await asyncio.shield(self._writing)
+        except Exception:
+            self._dirty = True
+            raise
+        finally:
+            self._writing = None
+
+    async def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.aflush()
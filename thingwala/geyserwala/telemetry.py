@@ -0,0 +1,251 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+"""Append-only columnar telemetry log.
+
+A file is a header followed by records. A schema record lists the value
+keys of the data records after it, so keys can be added at any point. A data
+record is a block of rows stored column by column: float64 times, then one
+float32 column per key with NaN for missing values. Readers memory-map the
+file and hand out zero-copy views of the columns.
+"""
+import json
+import math
+import mmap
+import os
+import struct
+import time
+
+from array import array
+
+from thingwala.geyserwala.errors import TelemetryError
+
+MAGIC = b"GWTL"
+VERSION = 1
+_FILE_HEADER = struct.Struct("<4sHH")
+# tag, payload bytes, rows, first time, last time (data records only)
+_RECORD_HEADER = struct.Struct("<4sIIIdd")
+_TAG_SCHEMA = b"SCHM"
+_TAG_DATA = b"DATA"
+
+
+def _pad(n):
+    return (8 - n % 8) % 8
+
+
+class TelemetryWriter:
+    def __init__(self, path, keys, block_rows=256) -> None:
+        self._path = path
+        self._block_rows = block_rows
+        self._keys = []
+        self._rows = []
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            with TelemetryReader(path) as reader:
+                self._keys = reader.keys
+                end = reader.end
+            self._f = open(path, "r+b")
+            # Drop any partly written trailing record
+            self._f.truncate(end)
+            self._f.seek(end)
+        else:
+            self._f = open(path, "wb")
+            self._f.write(_FILE_HEADER.pack(MAGIC, VERSION, 0))
+        self.add_keys(keys)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def keys(self):
+        return list(self._keys)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_keys(self, keys):
+        new = [k for k in keys if k not in self._keys]
+        if not new:
+            return
+        self.flush()
+        self._keys.extend(new)
+        payload = json.dumps(self._keys).encode("utf-8")
+        payload += b"\0" * _pad(len(payload))
+        self._f.write(_RECORD_HEADER.pack(_TAG_SCHEMA, len(payload), 0, 0, 0.0, 0.0))
+        self._f.write(payload)
+
+    def append(self, t, values):
+        row = [float(t)]
+        for key in self._keys:
+            value = values.get(key)
+            row.append(float(value) if isinstance(value, (bool, int, float)) else math.nan)
+        self._rows.append(row)
+        if len(self._rows) >= self._block_rows:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            rows = self._rows
+            self._rows = []
+            columns = [array("d", (r[0] for r in rows)).tobytes()]
+            for n in range(1, len(self._keys) + 1):
+                columns.append(array("f", (r[n] for r in rows)).tobytes())
+            payload = b"".join(c + b"\0" * _pad(len(c)) for c in columns)
+            self._f.write(
+                _RECORD_HEADER.pack(_TAG_DATA, len(payload), len(rows), 0, rows[0][0], rows[-1][0])
+            )
+            self._f.write(payload)
+        self._f.flush()
+
+    def close(self):
+        if not self._f.closed:
+            self.flush()
+            self._f.close()
+
+
+class TelemetryReader:
+    def __init__(self, path) -> None:
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mv = memoryview(self._mm)
+        magic, version, _ = _FILE_HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise TelemetryError(f"Not a telemetry file: {path}")
+        self._blocks = []
+        self._keys = []
+        self._end = _FILE_HEADER.size
+        self._index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._blocks = []
+        self._mv.release()
+        self._mm.close()
+
+    @property
+    def keys(self):
+        return list(self._keys)
+
+    @property
+    def end(self):
+        # Offset after the last complete record
+        return self._end
+
+    def _index(self):
+        offset = self._end
+        size = len(self._mm)
+        keys = []
+        while offset + _RECORD_HEADER.size <= size:
+            tag, length, rows, _, first, last = _RECORD_HEADER.unpack_from(self._mm, offset)
+            body = offset + _RECORD_HEADER.size
+            if body + length > size:
+                break
+            if tag == _TAG_SCHEMA:
+                keys = json.loads(bytes(self._mv[body:body + length]).rstrip(b"\0"))
+            elif tag == _TAG_DATA:
+                self._blocks.append((first, last, rows, body, keys))
+            else:
+                raise TelemetryError(f"Unknown record {tag!r} at {offset}")
+            offset = body + length
+        self._end = offset
+        self._keys = keys
+
+    def _columns(self, block):
+        _, _, rows, body, keys = block
+        times = self._mv[body:body + rows * 8].cast("d")
+        offset = body + rows * 8 + _pad(rows * 8)
+        columns = {}
+        for key in keys:
+            columns[key] = self._mv[offset:offset + rows * 4].cast("f")
+            offset += rows * 4 + _pad(rows * 4)
+        return times, columns
+
+    def scan(self, start=-math.inf, end=math.inf, keys=None):
+        # Yields (times, {key: values}) zero-copy views per block, cut to
+        # start <= time < end. Keys missing from a block's schema are left out.
+        # Views must be dropped before the reader is closed.
+        for block in self._blocks:
+            first, last = block[0], block[1]
+            if last < start or first >= end:
+                continue
+            times, columns = self._columns(block)
+            lo = _bisect(times, start)
+            hi = _bisect(times, end)
+            if lo >= hi:
+                continue
+            yield times[lo:hi], {
+                k: v[lo:hi] for k, v in columns.items() if keys is None or k in keys
+            }
+
+    def range(self, key, start=-math.inf, end=math.inf):
+        # Copy of one key's (times, values) across blocks
+        times = array("d")
+        values = array("f")
+        for block_times, columns in self.scan(start, end, [key]):
+            if key in columns:
+                times.frombytes(block_times.tobytes())
+                values.frombytes(columns[key].tobytes())
+        return times, values
+
+
+def _bisect(times, t):
+    lo, hi = 0, len(times)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if times[mid] < t:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class TelemetryLog:
+    """Daily telemetry files per device, fed by client polls."""
+
+    def __init__(self, directory, block_rows=256) -> None:
+        self._dir = directory
+        self._block_rows = block_rows
+        self._writers = {}
+
+    def path(self, device_id, t=None):
+        day = time.strftime("%Y%m%d", time.gmtime(time.time() if t is None else t))
+        return os.path.join(self._dir, f"{device_id}-{day}.gwtl")
+
+    def record(self, device_id, t, values):
+        keys = [k for k, v in values.items() if isinstance(v, (bool, int, float))]
+        path = self.path(device_id, t)
+        writer = self._writers.get(device_id)
+        if writer is None or writer.path != path:
+            if writer is not None:
+                writer.close()
+            writer = TelemetryWriter(path, keys, self._block_rows)
+            self._writers[device_id] = writer
+        else:
+            writer.add_keys(keys)
+        writer.append(t, values)
+
+    def attach(self, client):
+        def _record(c):
+            values = {k: c.get_value(k) for k in c.polled_keys}
+            self.record(c.id, c.last_update, values)
+
+        return client.add_update_listener(_record)
+
+    def flush(self):
+        for writer in self._writers.values():
+            writer.flush()
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
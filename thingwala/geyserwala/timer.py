@@ -0,0 +1,81 @@
+####################################################################################
+# Copyright (c) 2023 Thingwala                                                     #
+####################################################################################
+from dataclasses import dataclass, field
+from typing import Optional
+
+TIMER_OP_ADD = "add"
+TIMER_OP_UPDATE = "update"
+TIMER_OP_DELETE = "delete"
+
+
+@dataclass(frozen=True)
+class Timer:
+    """Device timer. begin and end are minutes past midnight, bit n of dow is
+    day n of the device's dow list. The id is ignored for equality."""
+
+    begin: int
+    end: int
+    temp: int
+    dow: int
+    id: int = field(default=0, compare=False)
+
+    @classmethod
+    def from_json(cls, blob: dict):
+        dow = 0
+        for n, on in enumerate(blob["dow"]):
+            if on:
+                dow |= 1 << n
+        return cls(
+            begin=blob["begin"][0] * 60 + blob["begin"][1],
+            end=blob["end"][0] * 60 + blob["end"][1],
+            temp=blob["temp"],
+            dow=dow,
+            id=blob.get("id", 0),
+        )
+
+    @property
+    def days(self):
+        return [bool(self.dow & (1 << n)) for n in range(7)]
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "begin": list(divmod(self.begin, 60)),
+            "end": list(divmod(self.end, 60)),
+            "temp": self.temp,
+            "dow": self.days,
+        }
+
+    def with_id(self, idx):
+        return Timer(self.begin, self.end, self.temp, self.dow, idx)
+
+
+@dataclass
+class TimerOp:
+    action: str
+    timer: Timer
+    ok: bool = False
+    error: Optional[Exception] = None
+
+
+def diff_timers(current, desired):
+    """Smallest list of operations turning the current timers into the desired
+    ones. Timers already present are left alone, left over current timers are
+    rewritten in place before any are deleted or added."""
+    unmatched = list(current)
+    wanted = []
+    for timer in desired:
+        try:
+            unmatched.remove(timer)
+        except ValueError:
+            wanted.append(timer)
+
+    ops = []
+    for old, new in zip(unmatched, wanted):
+        ops.append(TimerOp(TIMER_OP_UPDATE, new.with_id(old.id)))
+    for old in unmatched[len(wanted):]:
+        ops.append(TimerOp(TIMER_OP_DELETE, old))
+    for new in wanted[len(unmatched):]:
+        ops.append(TimerOp(TIMER_OP_ADD, new.with_id(0)))
+    return ops